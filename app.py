@@ -1,25 +1,153 @@
 import os
-from flask import Flask, request, render_template_string, redirect, url_for, g, jsonify
+import queue
+from flask import Flask, request, render_template, redirect, url_for, g, jsonify, send_file
+from jinja2 import FileSystemBytecodeCache
 from dotenv import load_dotenv
+from markupsafe import Markup, escape
 import sqlite3
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
+from socketio import PubSubManager
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from datetime import datetime
+from collections import OrderedDict, defaultdict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import requests
 import base64
-import io
+import functools
+import gzip
+import hashlib
+import json
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
 from PIL import Image
 import replicate
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your_secret_key_here')
+app.config['DATABASE_PATH'] = os.getenv('DATABASE_PATH', 'message_board.db')
+app.config['DB_READ_POOL_SIZE'] = int(os.getenv('DB_READ_POOL_SIZE', 8))
+app.config['DB_WRITE_POOL_SIZE'] = int(os.getenv('DB_WRITE_POOL_SIZE', 2))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+app.config['IMAGE_DIR'] = os.getenv('IMAGE_DIR', 'images')
+app.config['IMAGE_MAX_BYTES'] = int(os.getenv('IMAGE_MAX_BYTES', 20 * 1024 * 1024))
+app.config['IMAGE_VARIANT_DIR'] = os.getenv('IMAGE_VARIANT_DIR', 'image_variants')
+app.config['IMAGE_VARIANT_CACHE_BYTES'] = int(os.getenv('IMAGE_VARIANT_CACHE_BYTES', 512 * 1024 * 1024))
+app.config['FEED_PAGE_SIZE'] = int(os.getenv('FEED_PAGE_SIZE', 20))
+app.config['RENDER_CACHE_BACKEND'] = os.getenv('RENDER_CACHE_BACKEND', 'memory')
+app.config['RENDER_CACHE_BYTES'] = int(os.getenv('RENDER_CACHE_BYTES', 64 * 1024 * 1024))
+app.config['RENDER_CACHE_DIR'] = os.getenv('RENDER_CACHE_DIR', 'render_cache')
+app.config['TAG_RANKING_CACHE_TTL'] = int(os.getenv('TAG_RANKING_CACHE_TTL', 60))
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(os.getenv('TRENDING_HALF_LIFE_HOURS', 24))
+app.config['REACTION_BROADCAST_WINDOW'] = float(os.getenv('REACTION_BROADCAST_WINDOW', 0.2))
+app.config['REACTION_BROADCAST_MAX_BATCH'] = int(os.getenv('REACTION_BROADCAST_MAX_BATCH', 500))
+app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 300))
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 16))
+app.config['GENERATION_WORKERS'] = int(os.getenv('GENERATION_WORKERS', 2))
+app.config['GENERATION_QUEUE_SIZE'] = int(os.getenv('GENERATION_QUEUE_SIZE', 32))
+app.config['GENERATION_USER_LIMIT'] = int(os.getenv('GENERATION_USER_LIMIT', 4))
+app.config['GENERATION_CACHE_SIZE'] = int(os.getenv('GENERATION_CACHE_SIZE', 1024))
+app.config['GENERATION_CACHE_TTL'] = int(os.getenv('GENERATION_CACHE_TTL', 3600))
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+app.config['COMPRESSION_MIN_BYTES'] = int(os.getenv('COMPRESSION_MIN_BYTES', 1024))
+app.config['GZIP_LEVEL'] = int(os.getenv('GZIP_LEVEL', 6))
+app.config['BROTLI_QUALITY'] = int(os.getenv('BROTLI_QUALITY', 5))
+app.config['JINJA_CACHE_DIR'] = os.getenv('JINJA_CACHE_DIR', 'jinja_cache')
+
+# Compiled templates are kept on disk, so a new worker process loads them
+# instead of compiling every template again
+os.makedirs(app.config['JINJA_CACHE_DIR'], exist_ok=True)
+app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(app.config['JINJA_CACHE_DIR'])}
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
-socketio = SocketIO(app)
+
+class SQLiteQueueManager(PubSubManager):
+    """Socket.IO message queue kept in a local SQLite file.
+
+    A stand-in for Redis or RabbitMQ when every worker runs on the same
+    machine: emits are appended to a table and each worker polls it for
+    messages it has not seen yet. Old messages are pruned after ``retention``
+    seconds.
+    """
+    name = 'sqlite'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None,
+                 poll_interval=0.05, retention=60):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._publish_db = None
+        self._publish_lock = threading.Lock()
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._connect().close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS socketio_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        ''')
+        return db
+
+    def _publish(self, data):
+        with self._publish_lock:
+            if self._publish_db is None:
+                self._publish_db = self._connect()
+            self._publish_db.execute("INSERT INTO socketio_messages (channel, payload, created) VALUES (?, ?, ?)",
+                                     (self.channel, json.dumps(data), time.time()))
+            self._publish_db.commit()
+
+    def _listen(self):
+        db = self._connect()
+        last_id = db.execute("SELECT COALESCE(MAX(id), 0) FROM socketio_messages").fetchone()[0]
+        last_prune = time.time()
+        while True:
+            rows = db.execute("SELECT id, payload FROM socketio_messages WHERE id > ? AND channel = ? ORDER BY id",
+                              (last_id, self.channel)).fetchall()
+            for message_id, payload in rows:
+                last_id = message_id
+                yield json.loads(payload)
+            if time.time() - last_prune > self.retention:
+                last_prune = time.time()
+                db.execute("DELETE FROM socketio_messages WHERE created < ?", (last_prune - self.retention,))
+                db.commit()
+            self.server.sleep(self.poll_interval)
+
+def socketio_queue_options(url):
+    """SocketIO() arguments for the configured message queue, if any.
+
+    With a queue every worker process relays emits to its own clients, so
+    broadcasts and job updates reach users connected to any worker.
+    """
+    if not url:
+        return {}
+    if url.startswith('sqlite:///'):
+        return {'client_manager': SQLiteQueueManager(url)}
+    return {'message_queue': url}
+
+socketio = SocketIO(app, **socketio_queue_options(app.config['SOCKETIO_MESSAGE_QUEUE']))
 
 # Set your Replicate API token from environment variable
 replicate_api_token = os.getenv('REPLICATE_API_TOKEN')
@@ -28,14 +156,361 @@ if not replicate_api_token:
 os.environ["REPLICATE_API_TOKEN"] = replicate_api_token
 
 # Database setup
+SQLITE_PRAGMAS = (
+    # WAL lets readers and the writer work concurrently
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+)
+
+class ConnectionPool:
+    """A bounded pool of reusable SQLite connections.
+
+    Connections are handed to one thread (or greenlet) at a time, so they are
+    opened with check_same_thread=False. Read-only pools set query_only.
+    """
+
+    def __init__(self, path, size, timeout, read_only=False):
+        self.path = path
+        self.timeout = timeout
+        self.read_only = read_only
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        for pragma in SQLITE_PRAGMAS:
+            db.execute(pragma)
+        if self.read_only:
+            db.execute('PRAGMA query_only = ON')
+        return db
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, db):
+        try:
+            if db.in_transaction:
+                db.rollback()
+            self._idle.put(db)
+        except sqlite3.Error:
+            db.close()
+        finally:
+            self._slots.release()
+
+write_pool = ConnectionPool(app.config['DATABASE_PATH'], app.config['DB_WRITE_POOL_SIZE'],
+                            app.config['DB_POOL_TIMEOUT'])
+read_pool = ConnectionPool(app.config['DATABASE_PATH'], app.config['DB_READ_POOL_SIZE'],
+                           app.config['DB_POOL_TIMEOUT'], read_only=True)
+
 def get_db():
+    """Connection for work that writes, held until the app context ends."""
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect('message_board.db')
+        db = g._database = write_pool.acquire()
     return db
 
+def get_read_db():
+    """Read-only connection; under WAL long feed reads never block writers."""
+    db = getattr(g, '_read_database', None)
+    if db is None:
+        db = g._read_database = read_pool.acquire()
+    return db
+
+def read_row(sql, params):
+    """Fetch one row on a read connection that goes back to the pool at once.
+
+    For requests that go on to wait (e.g. for password hashing) and must not
+    keep a connection from everyone else meanwhile.
+    """
+    db = read_pool.acquire()
+    try:
+        return db.execute(sql, params).fetchone()
+    finally:
+        read_pool.release(db)
+
+# Image storage: images are stored once as raw bytes on disk, keyed by their
+# SHA-256 hash, and messages only keep a reference to that hash.
+IMAGE_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+def image_path(image_hash):
+    return os.path.join(app.config['IMAGE_DIR'], image_hash[:2], image_hash)
+
+IMAGE_CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp'}
+IMAGE_PIL_FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'webp': 'WEBP'}
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+def sniff_image_format(header):
+    # Identify the image format from its magic number without decoding it
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def _new_image_tempfile():
+    # Temporary files live inside IMAGE_DIR so os.replace never crosses filesystems
+    os.makedirs(app.config['IMAGE_DIR'], exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=app.config['IMAGE_DIR'], delete=False)
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(IMAGE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _save_image_file(tmp_path, image_hash, content_type, size):
+    """Move a complete temp file into the store; returns the images row to record."""
+    path = image_path(image_hash)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Renaming a complete file means readers never see a partial image
+        os.replace(tmp_path, path)
+    return image_hash, content_type, size
+
+def record_image(cursor, image_hash, content_type, size):
+    cursor.execute("INSERT OR IGNORE INTO images (hash, content_type, size) VALUES (?, ?, ?)",
+                   (image_hash, content_type, size))
+    return image_hash
+
+def store_image(cursor, data, content_type='image/png'):
+    with _new_image_tempfile() as tmp:
+        tmp.write(data)
+    return record_image(cursor, *_save_image_file(tmp.name, hashlib.sha256(data).hexdigest(), content_type,
+                                                  len(data)))
+
+def _transcode_image(source_path, output_format):
+    tmp = _new_image_tempfile()
+    try:
+        with tmp, Image.open(source_path) as image:
+            if output_format == 'jpg' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            image.save(tmp, format=IMAGE_PIL_FORMATS[output_format])
+        return _save_image_file(tmp.name, _hash_file(tmp.name), IMAGE_CONTENT_TYPES[output_format],
+                                os.path.getsize(tmp.name))
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+def ingest_image_url(url, output_format='png'):
+    """Stream an image download straight into the image store.
+
+    The bytes are hashed and written to disk chunk by chunk, validated by magic
+    number and size limit, and only decoded when they have to be transcoded
+    into a different format than the one requested. No database connection is
+    needed meanwhile: the returned (hash, content_type, size) is recorded with
+    record_image() afterwards.
+    """
+    max_bytes = app.config['IMAGE_MAX_BYTES']
+    digest = hashlib.sha256()
+    header = b''
+    size = 0
+    tmp = _new_image_tempfile()
+    try:
+        with tmp, requests.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            if int(response.headers.get('Content-Length') or 0) > max_bytes:
+                raise ValueError("Generated image exceeds the maximum image size")
+            for chunk in response.iter_content(chunk_size=IMAGE_CHUNK_SIZE):
+                if len(header) < 12:
+                    header += chunk[:12 - len(header)]
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError("Generated image exceeds the maximum image size")
+                digest.update(chunk)
+                tmp.write(chunk)
+        
+        image_format = sniff_image_format(header)
+        if image_format is None:
+            raise ValueError("Downloaded file is not a supported image")
+        if image_format != output_format:
+            return _transcode_image(tmp.name, output_format)
+        return _save_image_file(tmp.name, digest.hexdigest(), IMAGE_CONTENT_TYPES[image_format], size)
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+def image_exists(cursor, image_hash):
+    if not image_hash or not IMAGE_HASH_RE.match(image_hash):
+        return False
+    cursor.execute("SELECT 1 FROM images WHERE hash = ?", (image_hash,))
+    return cursor.fetchone() is not None
+
+# Resized WebP variants of stored images, generated on first request and kept
+# in a size-bounded on-disk cache (least recently used files are evicted first)
+IMAGE_VARIANTS = {'thumb': 256, 'feed': 800}
+
+_variant_lock = threading.Lock()
+_variant_cache_bytes = None
+
+def variant_path(image_hash, variant):
+    return os.path.join(app.config['IMAGE_VARIANT_DIR'], image_hash[:2], f'{image_hash}-{variant}.webp')
+
+def _variant_files():
+    for root, _, files in os.walk(app.config['IMAGE_VARIANT_DIR']):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                yield path, os.stat(path)
+            except OSError:
+                continue
+
+# Over-budget caches are evicted down to this fraction of their budget, so the
+# next writes fit without another directory scan
+CACHE_LOW_WATER = 0.8
+
+def evict_oldest_files(files, total, budget, keep=None):
+    """Remove the oldest (path, stat) entries until total is under the low-water mark.
+
+    The file at keep, usually the one just written, is never removed. Returns
+    the new total.
+    """
+    target = budget * CACHE_LOW_WATER
+    # Hits refresh the mtime, so the oldest mtime is the least recently used
+    for path, st in sorted(files, key=lambda entry: entry[1].st_mtime):
+        if total <= target:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= st.st_size
+    return total
+
+def _account_variant_bytes(added, keep=None):
+    global _variant_cache_bytes
+    budget = app.config['IMAGE_VARIANT_CACHE_BYTES']
+    with _variant_lock:
+        if _variant_cache_bytes is None:
+            _variant_cache_bytes = sum(st.st_size for _, st in _variant_files())
+        else:
+            _variant_cache_bytes += added
+        if _variant_cache_bytes > budget:
+            _variant_cache_bytes = evict_oldest_files(_variant_files(), _variant_cache_bytes, budget, keep)
+
+def get_image_variant(image_hash, variant):
+    path = variant_path(image_hash, variant)
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+    
+    width = IMAGE_VARIANTS[variant]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+    try:
+        with tmp, Image.open(image_path(image_hash)) as image:
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            image.save(tmp, format='WEBP', quality=80, method=4)
+        os.replace(tmp.name, path)
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+    _account_variant_bytes(os.path.getsize(path), keep=path)
+    return path
+
+@app.template_global()
+def image_srcset(image_hash):
+    return ', '.join(f"{url_for('image_variant', image_hash=image_hash, variant=variant)} {width}w"
+                     for variant, width in IMAGE_VARIANTS.items())
+
+class GenerationCache:
+    """Maps normalized Replicate inputs to the hash of the image they produced.
+
+    Entries expire after ``ttl`` seconds and the least recently used ones are
+    evicted beyond ``max_entries``. Concurrent calls with the same key share a
+    single upstream prediction instead of each starting their own.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_generate(self, key, generate):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(key, None)
+            
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        
+        if not owner:
+            return future.result()
+        
+        try:
+            result = generate()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        
+        with self._lock:
+            del self._inflight[key]
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'entries': len(self._entries),
+                'inflight': len(self._inflight)
+            }
+
+generation_cache = GenerationCache(app.config['GENERATION_CACHE_SIZE'], app.config['GENERATION_CACHE_TTL'])
+
+def generation_cache_key(input_data):
+    normalized = dict(input_data, prompt=' '.join((input_data['prompt'] or '').split()))
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
 # Add this function to handle image generation
-def generate_image_with_replicate(prompt, aspect_ratio="1:1", width=512, height=512):
+def generate_image_with_replicate(prompt, aspect_ratio="1:1", width=512, height=512, output_format="png",
+                                  seed=None, progress=None):
     model = "black-forest-labs/flux-1.1-pro"
     
     input_data = {
@@ -43,213 +518,1288 @@ def generate_image_with_replicate(prompt, aspect_ratio="1:1", width=512, height=
         "aspect_ratio": aspect_ratio,
         "width": width,
         "height": height,
-        "output_format": "png",
+        "output_format": output_format,
         "safety_tolerance": 2,
         "prompt_upsampling": False
     }
+    if seed is not None:
+        input_data["seed"] = seed
     
-    # Run the model
-    output = replicate.run(model, input=input_data)
-    
-    # Download and return the image
-    response = requests.get(output)
-    image = Image.open(io.BytesIO(response.content))
+    def generate():
+        # Run the model
+        if progress:
+            progress('generating')
+        output = replicate.run(model, input=input_data)
+        if isinstance(output, list):
+            output = output[0]
+        
+        # Stream the image into the image store and return its hash. A slow
+        # download must not hold one of the few write connections, so one is
+        # only taken for the INSERT
+        if progress:
+            progress('downloading')
+        stored = ingest_image_url(str(output), output_format)
+        db = get_db()
+        image_hash = record_image(db.cursor(), *stored)
+        db.commit()
+        return image_hash
     
-    # Convert image to base64
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
+    # Identical inputs reuse a recent result or join the prediction in flight
+    return generation_cache.get_or_generate(generation_cache_key(input_data), generate)
+
+# Socket.IO broadcasts carry ids and small metadata only; clients fetch images
+# by URL when they render them. BroadcastStats records what each event costs.
+class BroadcastStats:
+    def __init__(self):
+        self.connected_clients = 0
+        self.events = defaultdict(lambda: {'count': 0, 'payload_bytes': 0, 'fanout_bytes': 0})
+        self._lock = threading.Lock()
+
+    def client_connected(self):
+        with self._lock:
+            self.connected_clients += 1
+
+    def client_disconnected(self):
+        with self._lock:
+            self.connected_clients = max(0, self.connected_clients - 1)
+
+    def record(self, event, payload, recipients):
+        size = len(json.dumps(payload, separators=(',', ':')).encode())
+        with self._lock:
+            stats = self.events[event]
+            stats['count'] += 1
+            stats['payload_bytes'] += size
+            stats['fanout_bytes'] += size * recipients
+
+    def snapshot(self):
+        with self._lock:
+            return {'connected_clients': self.connected_clients,
+                    'events': {event: dict(stats) for event, stats in self.events.items()}}
+
+broadcast_stats = BroadcastStats()
+
+# Clients join rooms for what they are viewing: one feed room (home, a tag or a
+# profile) plus one room per message on screen, so events only reach clients
+# that can show them.
+MAX_WATCHED_MESSAGES = 1000
+
+def feed_room(feed):
+    return f'feed:{feed}'
+
+def message_room(message_id):
+    return f'message:{message_id}'
+
+def room_size(room):
+    # Participants connected to this process
+    return len(socketio.server.manager.rooms.get('/', {}).get(room, ()))
+
+def broadcast(event, payload, rooms):
+    recipients = 0
+    for room in rooms:
+        recipients += room_size(room)
+        socketio.emit(event, payload, room=room)
+    broadcast_stats.record(event, payload, recipients)
+
+class ReactionBroadcaster:
+    """Coalesces reaction changes into at most one reaction_update per message per window.
+
+    Reacting only marks the message as dirty. A background task wakes up every
+    ``window`` seconds, reads the counts of up to ``max_batch`` dirty messages
+    in one query and emits one update for each. While a backlog remains the
+    window doubles (up to 8x), so the emit rate stays bounded however many
+    reactions come in.
+    """
+
+    def __init__(self, window, max_batch):
+        self.window = window
+        self.max_batch = max_batch
+        self.updates = 0
+        self.flushes = 0
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._started = False
+
+    def mark(self, message_id):
+        with self._lock:
+            self._dirty[message_id] = None
+            start = not self._started
+            self._started = True
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        delay = self.window
+        while True:
+            socketio.sleep(delay)
+            try:
+                backlog = self.flush()
+            except Exception as e:
+                print(f"Error broadcasting reactions: {e}")
+                backlog = 0
+            delay = min(delay * 2, self.window * 8) if backlog else self.window
+
+    def flush(self):
+        with self._lock:
+            message_ids = list(self._dirty)[:self.max_batch]
+            for message_id in message_ids:
+                del self._dirty[message_id]
+            backlog = len(self._dirty)
+        if not message_ids:
+            return backlog
+        
+        reactions = defaultdict(dict)
+        with app.app_context():
+            cursor = get_read_db().cursor()
+            for chunk in _chunks(message_ids):
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f"SELECT message_id, reaction, count FROM reaction_counts WHERE message_id IN ({placeholders})",
+                               chunk)
+                for message_id, reaction, count in cursor.fetchall():
+                    reactions[message_id][reaction] = count
+        
+        for message_id in message_ids:
+            broadcast('reaction_update', {
+                'message_id': message_id,
+                'reactions': reactions[message_id]
+            }, [message_room(message_id)])
+        with self._lock:
+            self.updates += len(message_ids)
+            self.flushes += 1
+        return backlog
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._dirty), 'updates': self.updates, 'flushes': self.flushes}
+
+reaction_broadcaster = ReactionBroadcaster(app.config['REACTION_BROADCAST_WINDOW'],
+                                           app.config['REACTION_BROADCAST_MAX_BATCH'])
+
+# Image generation jobs: /generate_image only records a job and returns its id,
+# a bounded worker pool runs the Replicate calls, and state changes are pushed
+# to the requesting user's Socket.IO room as 'job_update' events.
+class GenerationQueueFull(Exception):
+    pass
+
+generation_executor = ThreadPoolExecutor(max_workers=app.config['GENERATION_WORKERS'],
+                                         thread_name_prefix='generation')
+# Counts queued and running jobs so the backlog stays bounded, globally and per user
+_generation_slots = threading.BoundedSemaphore(app.config['GENERATION_QUEUE_SIZE'])
+_user_generation_jobs = {}
+_user_generation_lock = threading.Lock()
+
+def _acquire_generation_slots(user_id, count):
+    with _user_generation_lock:
+        if _user_generation_jobs.get(user_id, 0) + count > app.config['GENERATION_USER_LIMIT']:
+            raise GenerationQueueFull("You already have too many image generations in progress")
+        acquired = 0
+        while acquired < count and _generation_slots.acquire(blocking=False):
+            acquired += 1
+        if acquired < count:
+            for _ in range(acquired):
+                _generation_slots.release()
+            raise GenerationQueueFull("Too many image generations in progress, please try again shortly")
+        _user_generation_jobs[user_id] = _user_generation_jobs.get(user_id, 0) + count
+
+def _release_generation_slot(user_id):
+    with _user_generation_lock:
+        remaining = _user_generation_jobs[user_id] - 1
+        if remaining:
+            _user_generation_jobs[user_id] = remaining
+        else:
+            del _user_generation_jobs[user_id]
+    _generation_slots.release()
+
+def user_room(user_id):
+    return f'user:{user_id}'
+
+def job_payload(job_id, status, stage=None, image_hash=None, error=None):
+    return {
+        'job_id': job_id,
+        'status': status,
+        'stage': stage,
+        'image_hash': image_hash,
+        'error': error
+    }
+
+def update_job(job_id, user_id, status, stage=None, image_hash=None, error=None):
+    db = get_db()
+    db.execute("UPDATE jobs SET status = ?, image_hash = ?, error = ?, updated = CURRENT_TIMESTAMP WHERE id = ?",
+               (status, image_hash, error, job_id))
+    db.commit()
+    socketio.emit('job_update', job_payload(job_id, status, stage, image_hash, error), room=user_room(user_id))
+
+def run_generation_job(job_id, user_id, params):
+    # Separate app contexts so no pooled connection is held while Replicate runs
+    try:
+        with app.app_context():
+            update_job(job_id, user_id, 'running')
+        try:
+            with app.app_context():
+                image_hash = generate_image_with_replicate(
+                    progress=lambda stage: socketio.emit('job_update', job_payload(job_id, 'running', stage),
+                                                         room=user_room(user_id)),
+                    **params)
+        except Exception as e:
+            with app.app_context():
+                update_job(job_id, user_id, 'failed', error=str(e))
+        else:
+            with app.app_context():
+                update_job(job_id, user_id, 'succeeded', image_hash=image_hash)
+    finally:
+        _release_generation_slot(user_id)
+
+def submit_generation_jobs(user_id, params_list, batch_id=None):
+    """Queue one job per params dict, all or nothing, and return their ids.
+
+    Each job reports back on its own as soon as it finishes, so a batch
+    streams its results in completion order.
+    """
+    _acquire_generation_slots(user_id, len(params_list))
+    job_ids = [uuid.uuid4().hex for _ in params_list]
+    try:
+        db = get_db()
+        db.executemany("INSERT INTO jobs (id, user_id, batch_id, status, params) VALUES (?, ?, ?, 'queued', ?)",
+                       [(job_id, user_id, batch_id, json.dumps(params))
+                        for job_id, params in zip(job_ids, params_list)])
+        db.commit()
+    except Exception:
+        for _ in params_list:
+            _release_generation_slot(user_id)
+        raise
+    for job_id, params in zip(job_ids, params_list):
+        generation_executor.submit(run_generation_job, job_id, user_id, params)
+    return job_ids
+
+def submit_generation_job(user_id, params):
+    return submit_generation_jobs(user_id, [params])[0]
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        write_pool.release(db)
+    read_db = g.pop('_read_database', None)
+    if read_db is not None:
+        read_pool.release(read_db)
 
-def init_db():
-    with app.app_context():
-        db = get_db()
-        cursor = db.cursor()
-        
-        # Create tables if they don't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             username TEXT UNIQUE NOT NULL,
-             password TEXT NOT NULL,
-             avatar TEXT)
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             user_id INTEGER,
-             content TEXT NOT NULL,
-             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-             FOREIGN KEY (user_id) REFERENCES users (id))
-        ''')
-        
-        # Check if image_data column exists in messages table
-        cursor.execute("PRAGMA table_info(messages)")
-        columns = [column[1] for column in cursor.fetchall()]
-        
-        # Add image_data column if it doesn't exist
-        if 'image_data' not in columns:
-            cursor.execute('ALTER TABLE messages ADD COLUMN image_data TEXT')
-        
-        # Create other tables (comments, tags, message_tags, reactions) as before
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS comments
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             user_id INTEGER,
-             message_id INTEGER,
-             content TEXT NOT NULL,
-             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-             FOREIGN KEY (user_id) REFERENCES users (id),
-             FOREIGN KEY (message_id) REFERENCES messages (id))
+# Schema migrations run once each, in order, and the number of applied steps
+# is recorded in schema_version. Released steps must not be edited; schema
+# changes go into a new step appended to MIGRATIONS.
+def migrate_initial_schema(cursor):
+    """Create the schema as it was before versioned migrations existed.
+
+    Databases from that time may already have some of these tables and
+    columns, so this step only adds what is missing.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         username TEXT UNIQUE NOT NULL,
+         password TEXT NOT NULL,
+         avatar TEXT)
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS messages
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id INTEGER,
+         content TEXT NOT NULL,
+         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+         FOREIGN KEY (user_id) REFERENCES users (id))
+    ''')
+    
+    cursor.execute("PRAGMA table_info(messages)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'image_data' not in columns:
+        cursor.execute('ALTER TABLE messages ADD COLUMN image_data TEXT')
+    if 'image_hash' not in columns:
+        cursor.execute('ALTER TABLE messages ADD COLUMN image_hash TEXT')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS images
+        (hash TEXT PRIMARY KEY,
+         content_type TEXT NOT NULL,
+         size INTEGER NOT NULL,
+         created DATETIME DEFAULT CURRENT_TIMESTAMP)
+    ''')
+    
+    # Move inline base64 images into the image store, one row at a time
+    cursor.execute("SELECT id FROM messages WHERE image_data IS NOT NULL")
+    for message_id in [row[0] for row in cursor.fetchall()]:
+        cursor.execute("SELECT image_data FROM messages WHERE id = ?", (message_id,))
+        image_data = cursor.fetchone()[0]
+        image_hash = store_image(cursor, base64.b64decode(image_data)) if image_data else None
+        cursor.execute("UPDATE messages SET image_hash = ?, image_data = NULL WHERE id = ?",
+                       (image_hash, message_id))
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS comments
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         user_id INTEGER,
+         message_id INTEGER,
+         content TEXT NOT NULL,
+         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+         FOREIGN KEY (user_id) REFERENCES users (id),
+         FOREIGN KEY (message_id) REFERENCES messages (id))
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tags
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         name TEXT UNIQUE NOT NULL)
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS message_tags
+        (message_id INTEGER,
+         tag_id INTEGER,
+         FOREIGN KEY (message_id) REFERENCES messages (id),
+         FOREIGN KEY (tag_id) REFERENCES tags (id),
+         PRIMARY KEY (message_id, tag_id))
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reactions
+        (id INTEGER PRIMARY KEY AUTOINCREMENT,
+         message_id INTEGER,
+         user_id INTEGER,
+         reaction TEXT,
+         FOREIGN KEY (message_id) REFERENCES messages (id),
+         FOREIGN KEY (user_id) REFERENCES users (id),
+         UNIQUE(message_id, user_id, reaction))
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs
+        (id TEXT PRIMARY KEY,
+         user_id INTEGER,
+         batch_id TEXT,
+         status TEXT NOT NULL,
+         params TEXT NOT NULL,
+         image_hash TEXT,
+         error TEXT,
+         created DATETIME DEFAULT CURRENT_TIMESTAMP,
+         updated DATETIME DEFAULT CURRENT_TIMESTAMP,
+         FOREIGN KEY (user_id) REFERENCES users (id))
+    ''')
+    
+    cursor.execute("PRAGMA table_info(jobs)")
+    if 'batch_id' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE jobs ADD COLUMN batch_id TEXT')
+
+def migrate_hot_query_indexes(cursor):
+    # Keyset-paginated feeds: home, profile and tag pages
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user_id, timestamp, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_tags_tag ON message_tags (tag_id, message_id)')
+    # Per-page comment, reaction and job lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_comments_message ON comments (message_id, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reactions_message ON reactions (message_id, reaction)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+
+def migrate_full_text_search(cursor):
+    # External-content FTS5 indexes over message and comment text, kept in
+    # sync with their source tables by triggers
+    for table in ('messages', 'comments'):
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts
+            USING fts5(content, content='{table}', content_rowid='id')
+        """)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_fts (rowid, content) VALUES (new.id, new.content);
+            END
         ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tags
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             name TEXT UNIQUE NOT NULL)
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END
         ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS message_tags
-            (message_id INTEGER,
-             tag_id INTEGER,
-             FOREIGN KEY (message_id) REFERENCES messages (id),
-             FOREIGN KEY (tag_id) REFERENCES tags (id),
-             PRIMARY KEY (message_id, tag_id))
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF content ON {table} BEGIN
+                INSERT INTO {table}_fts ({table}_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO {table}_fts (rowid, content) VALUES (new.id, new.content);
+            END
         ''')
+        cursor.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+def migrate_reaction_counts(cursor):
+    # Per-message reaction totals, maintained by triggers in the same
+    # transaction as every insert into or delete from reactions
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reaction_counts
+        (message_id INTEGER NOT NULL,
+         reaction TEXT NOT NULL,
+         count INTEGER NOT NULL,
+         PRIMARY KEY (message_id, reaction))
+        WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO reaction_counts (message_id, reaction, count)
+        SELECT message_id, reaction, COUNT(*) FROM reactions GROUP BY message_id, reaction
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS reaction_counts_insert AFTER INSERT ON reactions BEGIN
+            INSERT INTO reaction_counts (message_id, reaction, count) VALUES (new.message_id, new.reaction, 1)
+            ON CONFLICT (message_id, reaction) DO UPDATE SET count = count + 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS reaction_counts_delete AFTER DELETE ON reactions BEGIN
+            UPDATE reaction_counts SET count = count - 1
+            WHERE message_id = old.message_id AND reaction = old.reaction;
+            DELETE FROM reaction_counts
+            WHERE message_id = old.message_id AND reaction = old.reaction AND count <= 0;
+        END
+    ''')
+
+def migrate_tag_usage_counters(cursor):
+    # Total messages per tag, plus hourly buckets (unix time // 3600) of the
+    # last week used for the trending ranking
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tag_stats
+        (tag_id INTEGER PRIMARY KEY,
+         message_count INTEGER NOT NULL,
+         FOREIGN KEY (tag_id) REFERENCES tags (id))
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tag_stats_count ON tag_stats (message_count)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tag_buckets
+        (tag_id INTEGER NOT NULL,
+         bucket INTEGER NOT NULL,
+         count INTEGER NOT NULL,
+         PRIMARY KEY (tag_id, bucket))
+        WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tag_buckets_bucket ON tag_buckets (bucket)')
+    cursor.execute('''
+        INSERT OR REPLACE INTO tag_stats (tag_id, message_count)
+        SELECT tag_id, COUNT(*) FROM message_tags GROUP BY tag_id
+    ''')
+    cursor.execute('''
+        INSERT OR REPLACE INTO tag_buckets (tag_id, bucket, count)
+        SELECT message_tags.tag_id, CAST(strftime('%s', messages.timestamp) AS INTEGER) / 3600 AS bucket, COUNT(*)
+        FROM message_tags
+        JOIN messages ON messages.id = message_tags.message_id
+        WHERE messages.timestamp >= datetime('now', '-7 days')
+        GROUP BY message_tags.tag_id, bucket
+    ''')
+
+def migrate_board_version(cursor):
+    # A single counter bumped by every write that changes what a feed page
+    # shows; feed ETags are derived from it
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS board_state
+        (id INTEGER PRIMARY KEY CHECK (id = 1),
+         version INTEGER NOT NULL)
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO board_state (id, version) VALUES (1, 0)')
+    for table in ('messages', 'comments', 'reactions', 'message_tags'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS board_version_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE board_state SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS board_version_users_update AFTER UPDATE OF username, avatar ON users BEGIN
+            UPDATE board_state SET version = version + 1 WHERE id = 1;
+        END
+    ''')
+
+MIGRATIONS = [
+    migrate_initial_schema,
+    migrate_hot_query_indexes,
+    migrate_full_text_search,
+    migrate_reaction_counts,
+    migrate_tag_usage_counters,
+    migrate_board_version,
+]
+
+def migrate_db(db):
+    db.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    applied = False
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        # BEGIN IMMEDIATE takes the write lock before reading the version, so
+        # concurrently starting processes never run the same step twice
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT version FROM schema_version').fetchone()
+            if row is not None and row[0] >= version:
+                db.rollback()
+                continue
+            migration(db.cursor())
+            if row is None:
+                db.execute('INSERT INTO schema_version (version) VALUES (?)', (version,))
+            else:
+                db.execute('UPDATE schema_version SET version = ?', (version,))
+            db.commit()
+            applied = True
+        except Exception:
+            db.rollback()
+            raise
+    
+    # Reclaim space freed by migrations (e.g. moved base64 images)
+    if applied:
+        freelist_count = db.execute('PRAGMA freelist_count').fetchone()[0]
+        page_count = db.execute('PRAGMA page_count').fetchone()[0]
+        if freelist_count * 4 > page_count:
+            db.execute('VACUUM')
+
+def init_db():
+    """Migrate the schema and fail jobs left over from a previous run.
+
+    Workers started by serve.py skip this; the parent process runs it once,
+    so one worker starting up cannot fail jobs another worker is running.
+    """
+    with app.app_context():
+        db = get_db()
+        migrate_db(db)
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reactions
-            (id INTEGER PRIMARY KEY AUTOINCREMENT,
-             message_id INTEGER,
-             user_id INTEGER,
-             reaction TEXT,
-             FOREIGN KEY (message_id) REFERENCES messages (id),
-             FOREIGN KEY (user_id) REFERENCES users (id),
-             UNIQUE(message_id, user_id, reaction))
+        # Jobs that were in flight when the server stopped will never finish
+        db.execute('''
+            UPDATE jobs SET status = 'failed', error = 'Interrupted by server restart', updated = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running')
         ''')
-        
         db.commit()
 
-init_db()
+if not os.getenv('SERVE_WORKER'):
+    init_db()
+
+class User:
+    """A logged-in user, with just the attributes flask-login expects."""
+    __slots__ = ('id', 'username', 'avatar')
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
 
-class User(UserMixin):
     def __init__(self, id, username, avatar):
         self.id = id
         self.username = username
         self.avatar = avatar
 
+    def get_id(self):
+        return str(self.id)
+
+class UserCache:
+    """Users by id, so authenticated requests do not each query the users table.
+
+    Entries expire after ``ttl`` seconds, which also bounds how long another
+    worker can serve a stale profile; the least recently used ones are
+    evicted beyond ``max_entries``.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+
+    def put(self, user):
+        with self._lock:
+            self._entries[user.get_id()] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.get_id())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(str(user_id), None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else None,
+                'entries': len(self._entries)
+            }
+
+user_cache = UserCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+
+def invalidate_user(user_id):
+    """Call after changing a user's row so the next request reloads it."""
+    user_cache.invalidate(user_id)
+
 @login_manager.user_loader
 def load_user(user_id):
-    db = get_db()
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    db = get_read_db()
     cursor = db.cursor()
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    if user:
-        return User(user[0], user[1], user[3])
-    return None
+    cursor.execute("SELECT id, username, avatar FROM users WHERE id = ?", (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    user = User(*row)
+    user_cache.put(user)
+    return user
 
-@app.route('/')
-def index():
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute('''
-        SELECT messages.id, messages.content, messages.image_data, messages.timestamp, users.username, users.avatar
+# Password hashing is deliberately slow, so it runs off the request thread on
+# a small bounded pool. Under eventlet it runs on eventlet's pool of real OS
+# threads instead, since hashing in a green thread would stall every other
+# greenlet, socket broadcasts included; a green semaphore then keeps it to
+# PASSWORD_HASH_WORKERS at a time.
+class PasswordQueueFull(Exception):
+    pass
+
+password_executor = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                       thread_name_prefix='password')
+_password_slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_QUEUE_SIZE'])
+_password_workers = threading.BoundedSemaphore(app.config['PASSWORD_HASH_WORKERS'])
+_password_hash_prefix = None
+
+def _run_password_task(function, *args):
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordQueueFull("Too many logins in progress, please try again shortly")
+    try:
+        if socketio.async_mode == 'eventlet':
+            from eventlet import tpool
+            with _password_workers:
+                return tpool.execute(function, *args)
+        return password_executor.submit(function, *args).result()
+    finally:
+        _password_slots.release()
+
+def hash_password(password):
+    return _run_password_task(generate_password_hash, password, app.config['PASSWORD_HASH_METHOD'])
+
+def verify_password(password_hash, password):
+    return _run_password_task(check_password_hash, password_hash, password)
+
+def password_needs_rehash(password_hash):
+    """True when a stored hash was made with another method or cost than configured."""
+    global _password_hash_prefix
+    if _password_hash_prefix is None:
+        # Werkzeug fills in defaults (e.g. iterations), so compare against a real hash
+        _password_hash_prefix = hash_password('').split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _password_hash_prefix
+
+# Feed assembly shared by the home page, tag pages and profiles
+FeedMessage = namedtuple('FeedMessage', 'id content image_hash timestamp username avatar comments tags reactions')
+FeedComment = namedtuple('FeedComment', 'content timestamp username avatar')
+
+# Stay well below SQLite's limit on bound parameters per statement
+SQL_IN_CHUNK_SIZE = 500
+
+def _chunks(items, size=SQL_IN_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+FEED_RELATIONS = ('comments', 'tags', 'reactions')
+
+def load_feed(cursor, rows, include=FEED_RELATIONS):
+    """Turn (id, content, image_hash, timestamp, username, avatar) rows into FeedMessages.
+
+    Comments, tags and reaction counts for the whole page are fetched with one
+    query each (per chunk of ids), however many messages the page holds.
+    Relations left out of ``include`` are not queried and stay empty.
+    """
+    comments = defaultdict(list)
+    tags = defaultdict(list)
+    reactions = defaultdict(dict)
+    for chunk in _chunks([row[0] for row in rows]):
+        placeholders = ','.join('?' * len(chunk))
+        if 'comments' in include:
+            cursor.execute(f'''
+                SELECT comments.message_id, comments.content, comments.timestamp, users.username, users.avatar
+                FROM comments
+                JOIN users ON comments.user_id = users.id
+                WHERE comments.message_id IN ({placeholders})
+                ORDER BY comments.timestamp ASC
+            ''', chunk)
+            for row in cursor.fetchall():
+                comments[row[0]].append(FeedComment(*row[1:]))
+        
+        if 'tags' in include:
+            cursor.execute(f'''
+                SELECT message_tags.message_id, tags.name
+                FROM tags
+                JOIN message_tags ON tags.id = message_tags.tag_id
+                WHERE message_tags.message_id IN ({placeholders})
+            ''', chunk)
+            for message_id, name in cursor.fetchall():
+                tags[message_id].append(name)
+        
+        if 'reactions' in include:
+            cursor.execute(f'''
+                SELECT message_id, reaction, count
+                FROM reaction_counts
+                WHERE message_id IN ({placeholders})
+            ''', chunk)
+            for message_id, reaction, count in cursor.fetchall():
+                reactions[message_id][reaction] = count
+    
+    return [FeedMessage(*row, comments[row[0]], tags[row[0]], reactions[row[0]]) for row in rows]
+
+# Feeds are paginated by keyset on (timestamp, id), newest first, so a deep
+# page costs the same index range scan as the first one
+FEED_COLUMNS = 'messages.id, messages.content, messages.image_hash, messages.timestamp, users.username, users.avatar'
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f'{timestamp}|{row_id}'.encode()).decode().rstrip('=')
+
+def decode_cursor(page_cursor):
+    try:
+        raw = base64.urlsafe_b64decode(page_cursor + '=' * (-len(page_cursor) % 4)).decode()
+        timestamp, message_id = raw.rsplit('|', 1)
+        return timestamp, int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def fetch_feed_page(cursor, page_cursor=None, user_id=None, tag_name=None, include=FEED_RELATIONS):
+    """Return one page of FeedMessages and the cursor of the next page (or None)."""
+    limit = app.config['FEED_PAGE_SIZE']
+    position = decode_cursor(page_cursor) if page_cursor else None
+    joins = ''
+    conditions = []
+    params = []
+    if tag_name is not None:
+        # Tag pages walk message_tags(tag_id, message_id) instead; message ids
+        # are allocated in timestamp order, so the order is the same
+        joins = 'JOIN message_tags ON messages.id = message_tags.message_id JOIN tags ON message_tags.tag_id = tags.id'
+        conditions.append('tags.name = ?')
+        params.append(tag_name)
+        if position:
+            conditions.append('message_tags.message_id < ?')
+            params.append(position[1])
+        order = 'message_tags.message_id DESC'
+    else:
+        if user_id is not None:
+            conditions.append('messages.user_id = ?')
+            params.append(user_id)
+        if position:
+            conditions.append('(messages.timestamp, messages.id) < (?, ?)')
+            params.extend(position)
+        order = 'messages.timestamp DESC, messages.id DESC'
+    where = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+    
+    # Fetch one extra row to find out whether there is a next page
+    cursor.execute(f'''
+        SELECT {FEED_COLUMNS}
         FROM messages
         JOIN users ON messages.user_id = users.id
-        ORDER BY messages.timestamp DESC
-    ''')
-    messages = cursor.fetchall()
-    
-    for i, message in enumerate(messages):
-        cursor.execute('''
-            SELECT comments.content, comments.timestamp, users.username, users.avatar
-            FROM comments
-            JOIN users ON comments.user_id = users.id
-            WHERE comments.message_id = ?
-            ORDER BY comments.timestamp ASC
-        ''', (message[0],))
-        comments = cursor.fetchall()
+        {joins}
+        {where}
+        ORDER BY {order}
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cursor.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+    return load_feed(cursor, rows[:limit], include), next_cursor
+
+def fetch_comment_page(cursor, message_id, page_cursor=None):
+    """Return one page of a message's comments, oldest first, and the next cursor."""
+    limit = app.config['FEED_PAGE_SIZE']
+    conditions = ['comments.message_id = ?']
+    params = [message_id]
+    if page_cursor:
+        conditions.append('(comments.timestamp, comments.id) > (?, ?)')
+        params.extend(decode_cursor(page_cursor))
+    cursor.execute(f'''
+        SELECT comments.id, comments.content, comments.timestamp, users.username, users.avatar
+        FROM comments
+        JOIN users ON comments.user_id = users.id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY comments.timestamp ASC, comments.id ASC
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cursor.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][2], rows[limit - 1][0]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+# Rendered feed cache: the ids on each feed page and the HTML of each message
+# are cached under keys that embed a version token. Writes replace the token
+# of what they touch (a feed for new messages, a message for new comments and
+# reactions), so stale entries are never read again and age out of the LRU.
+class MemoryCacheBackend:
+    """In-process LRU of byte strings bounded to ``max_bytes`` in total."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = value
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.bytes}
+
+class FileCacheBackend:
+    """LRU of byte strings in a directory, shared by every worker on the machine.
+
+    Like the image variant cache, hits refresh a file's mtime and, once the
+    directory grows beyond ``max_bytes``, the oldest files are removed until it
+    is back under the low-water mark.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, name[:2], name)
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    continue
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as tmp:
+            tmp.write(value)
+        os.replace(tmp.name, path)
+        with self._lock:
+            if self.bytes is not None:
+                self.bytes += len(value)
+            if self.bytes is not None and self.bytes <= self.max_bytes:
+                return
+            # Other workers write here too, so recount before evicting
+            files = list(self._files())
+            self.bytes = sum(st.st_size for _, st in files)
+            if self.bytes > self.max_bytes:
+                self.bytes = evict_oldest_files(files, self.bytes, self.max_bytes, keep=path)
+
+    def stats(self):
+        with self._lock:
+            return {'bytes': self.bytes}
+
+class RenderCache:
+    """JSON values and version tokens on top of a cache backend."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        self.backend.set(key, json.dumps(value, separators=(',', ':')).encode())
+
+    def version(self, name):
+        # An evicted token is simply replaced, which only causes extra misses
+        token = self.backend.get(f'version:{name}')
+        if token is None:
+            return self.bump(name)
+        return token.decode()
+
+    def bump(self, name):
+        # A fresh random token rather than a counter, so concurrent bumps from
+        # several workers can never collapse into one
+        token = uuid.uuid4().hex
+        self.backend.set(f'version:{name}', token.encode())
+        return token
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, **self.backend.stats()}
+
+if app.config['RENDER_CACHE_BACKEND'] == 'file':
+    render_cache = RenderCache(FileCacheBackend(app.config['RENDER_CACHE_DIR'], app.config['RENDER_CACHE_BYTES']))
+else:
+    render_cache = RenderCache(MemoryCacheBackend(app.config['RENDER_CACHE_BYTES']))
+
+def render_message(message, snippet=None):
+    return Markup(render_template('_message.html', message=message, snippet=snippet))
+
+def render_messages(cursor, message_ids):
+    """Rendered HTML of the given messages, from the cache where possible."""
+    # The comment form is the only part that depends on the viewer
+    viewer = 'user' if current_user.is_authenticated else 'anonymous'
+    keys = {message_id: f'message:{message_id}:{viewer}:{render_cache.version(f"message:{message_id}")}'
+            for message_id in message_ids}
+    fragments = {message_id: render_cache.get(key) for message_id, key in keys.items()}
+    missing = [message_id for message_id, fragment in fragments.items() if fragment is None]
+    for chunk in _chunks(missing):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT {FEED_COLUMNS}
+            FROM messages
+            JOIN users ON messages.user_id = users.id
+            WHERE messages.id IN ({placeholders})
+        ''', chunk)
+        for message in load_feed(cursor, cursor.fetchall()):
+            fragments[message.id] = render_message(message)
+            render_cache.set(keys[message.id], fragments[message.id])
+    return [Markup(fragments[message_id]) for message_id in message_ids if fragments[message_id] is not None]
+
+def render_feed_page(cursor, feed, page_cursor=None, **filters):
+    """Rendered messages of one feed page and the cursor of the next page."""
+    # Read the version before querying, so a write that lands meanwhile
+    # leaves this entry under the old version
+    key = f'page:{feed}:{page_cursor or ""}:{render_cache.version(f"feed:{feed}")}'
+    page = render_cache.get(key)
+    if page is None:
+        messages, next_cursor = fetch_feed_page(cursor, page_cursor, include=(), **filters)
+        page = [[message.id for message in messages], next_cursor]
+        render_cache.set(key, page)
+    message_ids, next_cursor = page
+    return render_messages(cursor, message_ids), next_cursor
+
+# Tag rankings: usage counters are maintained as messages are posted, so the
+# home page never aggregates message_tags. Trending scores weigh the hourly
+# counts of the last week with an exponential decay.
+TAG_BUCKET_SECONDS = 3600
+TAG_TRENDING_BUCKETS = 24 * 7
+
+TrendingTag = namedtuple('TrendingTag', 'name score last_hour last_day last_week')
+
+class TagRankings:
+    """Caches computed tag rankings until the next write or for at most ``ttl`` seconds."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+tag_rankings = TagRankings(app.config['TAG_RANKING_CACHE_TTL'])
+
+def current_tag_bucket():
+    return int(time.time()) // TAG_BUCKET_SECONDS
+
+def record_tag_usage(cursor, tag_ids):
+    bucket = current_tag_bucket()
+    cursor.executemany('''
+        INSERT INTO tag_stats (tag_id, message_count) VALUES (?, 1)
+        ON CONFLICT (tag_id) DO UPDATE SET message_count = message_count + 1
+    ''', [(tag_id,) for tag_id in tag_ids])
+    cursor.executemany('''
+        INSERT INTO tag_buckets (tag_id, bucket, count) VALUES (?, ?, 1)
+        ON CONFLICT (tag_id, bucket) DO UPDATE SET count = count + 1
+    ''', [(tag_id, bucket) for tag_id in tag_ids])
+    cursor.execute("DELETE FROM tag_buckets WHERE bucket <= ?", (bucket - TAG_TRENDING_BUCKETS,))
+
+# Tag resolution: tags are normalized and deduplicated, ids are looked up with
+# set-based statements and remembered in-process, since tags are never renamed
+# or deleted. Lookups run inside the caller's transaction, which may still roll
+# back and free the ids of tags it created, so callers only remember ids with
+# remember_tag_ids() after committing.
+TAG_ID_CACHE_SIZE = 10000
+
+_tag_id_cache = {}
+_tag_id_lock = threading.Lock()
+
+def normalize_tags(raw_tags):
+    """Lower-case and strip tags, dropping empty and duplicate ones."""
+    return list(dict.fromkeys(tag.strip().lower() for tag in raw_tags if tag and tag.strip()))
+
+def _select_tag_ids(cursor, names):
+    found = {}
+    for chunk in _chunks(names):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f"SELECT name, id FROM tags WHERE name IN ({placeholders})", chunk)
+        found.update(cursor.fetchall())
+    return found
+
+def resolve_tag_ids(cursor, names):
+    """Return {name: id} for normalized tag names, creating the missing tags."""
+    with _tag_id_lock:
+        tag_ids = {name: _tag_id_cache[name] for name in names if name in _tag_id_cache}
+    missing = [name for name in names if name not in tag_ids]
+    if missing:
+        existing = _select_tag_ids(cursor, missing)
+        tag_ids.update(existing)
         
+        created = [name for name in missing if name not in existing]
+        if created:
+            cursor.executemany("INSERT OR IGNORE INTO tags (name) VALUES (?)", [(name,) for name in created])
+            tag_ids.update(_select_tag_ids(cursor, created))
+    return tag_ids
+
+def remember_tag_ids(tag_ids):
+    """Cache a {name: id} mapping from resolve_tag_ids once its transaction has committed."""
+    with _tag_id_lock:
+        new = {name: tag_id for name, tag_id in tag_ids.items() if name not in _tag_id_cache}
+        if len(_tag_id_cache) + len(new) > TAG_ID_CACHE_SIZE:
+            _tag_id_cache.clear()
+        _tag_id_cache.update(new)
+
+def attach_tags(cursor, posts):
+    """Tag any number of messages at once.
+
+    ``posts`` is a list of (message_id, raw tags) pairs. Returns a dict mapping
+    each message id to its normalized tags, and the {name: id} mapping of the
+    tags used, to be passed to remember_tag_ids() after committing.
+    """
+    normalized = {message_id: normalize_tags(raw_tags) for message_id, raw_tags in posts}
+    names = list(dict.fromkeys(name for tags in normalized.values() for name in tags))
+    if not names:
+        return normalized, {}
+    
+    tag_ids = resolve_tag_ids(cursor, names)
+    links = [(message_id, tag_ids[name]) for message_id, tags in normalized.items() for name in tags]
+    cursor.executemany("INSERT OR IGNORE INTO message_tags (message_id, tag_id) VALUES (?, ?)", links)
+    record_tag_usage(cursor, [tag_id for _, tag_id in links])
+    return normalized, tag_ids
+
+def popular_tags(cursor, limit=10):
+    def compute():
         cursor.execute('''
-            SELECT tags.name
-            FROM tags
-            JOIN message_tags ON tags.id = message_tags.tag_id
-            WHERE message_tags.message_id = ?
-        ''', (message[0],))
-        tags = [tag[0] for tag in cursor.fetchall()]
-        
+            SELECT tags.name, tag_stats.message_count
+            FROM tag_stats
+            JOIN tags ON tags.id = tag_stats.tag_id
+            ORDER BY tag_stats.message_count DESC
+            LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()
+    return tag_rankings.get(('popular', limit), compute)
+
+def trending_tags(cursor, limit=10):
+    def compute():
+        now = current_tag_bucket()
+        half_life = app.config['TRENDING_HALF_LIFE_HOURS'] * 3600 / TAG_BUCKET_SECONDS
         cursor.execute('''
-            SELECT reaction, COUNT(*) as count
-            FROM reactions
-            WHERE message_id = ?
-            GROUP BY reaction
-        ''', (message[0],))
-        reactions = dict(cursor.fetchall())
-        
-        messages[i] = message + (comments, tags, reactions)
+            SELECT tags.name, tag_buckets.bucket, tag_buckets.count
+            FROM tag_buckets
+            JOIN tags ON tags.id = tag_buckets.tag_id
+            WHERE tag_buckets.bucket > ?
+        ''', (now - TAG_TRENDING_BUCKETS,))
+        totals = defaultdict(lambda: [0.0, 0, 0, 0])
+        for name, bucket, count in cursor.fetchall():
+            age = max(0, now - bucket)
+            entry = totals[name]
+            entry[0] += count * 0.5 ** (age / half_life)
+            if age < 1:
+                entry[1] += count
+            if age < 24:
+                entry[2] += count
+            entry[3] += count
+        ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [TrendingTag(name, *entry) for name, entry in ranked]
+    return tag_rankings.get(('trending', limit), compute)
+
+@app.template_global()
+def next_page_url(next_cursor):
+    # Keep the current query string (e.g. a search query) on the next page link
+    args = request.args.to_dict()
+    args['cursor'] = next_cursor
+    return url_for(request.endpoint, **request.view_args, **args)
+
+# Full-text search over messages and their comments, ranked by bm25. Matches
+# are wrapped in these control characters by snippet() and turned into
+# <mark> tags only after the rest of the snippet has been escaped.
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+
+def fts_query(text):
+    # Quote every word so user input can never be parsed as FTS5 syntax
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in re.findall(r'\w+', text))
+
+def render_snippet(snippet):
+    return Markup(str(escape(snippet)).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
+def search_messages(cursor, text, page_cursor=None):
+    """Return one page of matching FeedMessages, their snippets, and the next cursor."""
+    limit = app.config['FEED_PAGE_SIZE']
+    offset = int(page_cursor) if page_cursor else 0
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    query = fts_query(text)
+    if not query:
+        return [], {}, None
     
+    # A message ranks by its best match, in its own text or in any comment
     cursor.execute('''
-        SELECT tags.name, COUNT(*) as tag_count
-        FROM tags
-        JOIN message_tags ON tags.id = message_tags.tag_id
-        GROUP BY tags.id
-        ORDER BY tag_count DESC
-        LIMIT 10
-    ''')
-    popular_tags = cursor.fetchall()
+        SELECT message_id, MIN(rank) AS best_rank, snippet
+        FROM (
+            SELECT messages_fts.rowid AS message_id, messages_fts.rank AS rank,
+                   snippet(messages_fts, 0, ?, ?, '…', 12) AS snippet
+            FROM messages_fts
+            WHERE messages_fts MATCH ?
+            UNION ALL
+            SELECT comments.message_id, comments_fts.rank,
+                   snippet(comments_fts, 0, ?, ?, '…', 12)
+            FROM comments_fts
+            JOIN comments ON comments.id = comments_fts.rowid
+            WHERE comments_fts MATCH ?
+        )
+        GROUP BY message_id
+        ORDER BY best_rank, message_id DESC
+        LIMIT ? OFFSET ?
+    ''', (SNIPPET_START, SNIPPET_END, query, SNIPPET_START, SNIPPET_END, query, limit + 1, offset))
+    hits = cursor.fetchall()
+    next_cursor = str(offset + limit) if len(hits) > limit else None
+    hits = hits[:limit]
+    if not hits:
+        return [], {}, None
     
-    return render_template_string(BASE_HTML, messages=messages, popular_tags=popular_tags)
+    placeholders = ','.join('?' * len(hits))
+    cursor.execute(f'''
+        SELECT {FEED_COLUMNS}
+        FROM messages
+        JOIN users ON messages.user_id = users.id
+        WHERE messages.id IN ({placeholders})
+    ''', [hit[0] for hit in hits])
+    rows = {row[0]: row for row in cursor.fetchall()}
+    messages = load_feed(cursor, [rows[hit[0]] for hit in hits if hit[0] in rows])
+    snippets = {hit[0]: render_snippet(hit[2]) for hit in hits}
+    return messages, snippets, next_cursor
+
+# Conditional GET for feed pages: the weak ETag covers every write shown on
+# a page (through board_state), the hourly tag buckets of the sidebar, the
+# viewer, the URL and the deployed templates and assets, so it is checked
+# before running any feed query or rendering anything.
+def _site_build():
+    digest = hashlib.sha256()
+    for folder in (app.template_folder, app.static_folder):
+        for root, _, files in sorted(os.walk(os.path.join(app.root_path, folder))):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(f'{path}|{os.stat(path).st_mtime_ns}'.encode())
+    return digest.hexdigest()
+
+SITE_BUILD = _site_build()
+
+def feed_etag():
+    version = get_read_db().execute("SELECT version FROM board_state WHERE id = 1").fetchone()[0]
+    raw = f'{version}|{current_tag_bucket()}|{current_user.get_id()}|{request.full_path}|{SITE_BUILD}'
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+def conditional_feed(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        etag = feed_etag()
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        else:
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        # Pages differ per viewer, so only the browser may keep them
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+@app.route('/')
+@conditional_feed
+def index():
+    db = get_read_db()
+    cursor = db.cursor()
+    try:
+        fragments, next_cursor = render_feed_page(cursor, 'home', request.args.get('cursor'))
+    except ValueError as e:
+        return str(e), 400
+    
+    return render_template('base.html', fragments=fragments, next_cursor=next_cursor, feed='home',
+                           popular_tags=popular_tags(cursor), trending_tags=trending_tags(cursor))
 
 @app.route('/post_message', methods=['POST'])
 @login_required
 def post_message():
     content = request.form.get('content')
     tags = request.form.get('tags', '').split(',')
-    image_data = request.form.get('image_data')
+    image_hash = request.form.get('image_hash')
     
-    if content or image_data:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("INSERT INTO messages (user_id, content, image_data) VALUES (?, ?, ?)",
-                       (current_user.id, content, image_data))
+    db = get_db()
+    cursor = db.cursor()
+    if not image_exists(cursor, image_hash):
+        image_hash = None
+    
+    if content or image_hash:
+        cursor.execute("INSERT INTO messages (user_id, content, image_hash) VALUES (?, ?, ?)",
+                       (current_user.id, content, image_hash))
         message_id = cursor.lastrowid
         
-        for tag in tags:
-            tag = tag.strip().lower()
-            if tag:
-                cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag,))
-                cursor.execute("SELECT id FROM tags WHERE name = ?", (tag,))
-                tag_id = cursor.fetchone()[0]
-                cursor.execute("INSERT INTO message_tags (message_id, tag_id) VALUES (?, ?)",
-                               (message_id, tag_id))
+        tags, tag_ids = attach_tags(cursor, [(message_id, tags)])
+        tags = tags[message_id]
         
         db.commit()
+        remember_tag_ids(tag_ids)
+        if tags:
+            tag_rankings.invalidate()
+        for feed in ['home'] + [f'tag:{tag}' for tag in tags]:
+            render_cache.bump(f'feed:{feed}')
         
         cursor.execute('''
-            SELECT messages.id, messages.content, messages.image_data, messages.timestamp, users.username, users.avatar
+            SELECT messages.id, messages.content, messages.image_hash, messages.timestamp, users.username, users.avatar
             FROM messages
             JOIN users ON messages.user_id = users.id
             WHERE messages.id = ?
         ''', (message_id,))
         new_message = cursor.fetchone()
         
-        socketio.emit('new_message', {
+        broadcast('new_message', {
             'id': new_message[0],
             'content': new_message[1],
-            'image_data': new_message[2],
+            'image_hash': new_message[2],
             'timestamp': new_message[3],
             'username': new_message[4],
             'avatar': new_message[5],
-            'tags': tags,
-            'reactions': {}
-        })
+            'tags': tags
+        }, [feed_room('home'), feed_room(f'profile:{new_message[4]}')] + [feed_room(f'tag:{tag}') for tag in tags])
     return redirect(url_for('index'))
 
 @app.route('/generate_image', methods=['POST'])
@@ -261,55 +1811,209 @@ def generate_image():
     height = int(request.form.get('height', 512))
     
     try:
-        image_data = generate_image_with_replicate(prompt, aspect_ratio, width, height)
-        return jsonify({"image_data": image_data})
+        job_id = submit_generation_job(current_user.id, {
+            'prompt': prompt,
+            'aspect_ratio': aspect_ratio,
+            'width': width,
+            'height': height
+        })
+        return jsonify({"job_id": job_id}), 202
+    except GenerationQueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/generate_batch', methods=['POST'])
+@login_required
+def generate_batch():
+    prompt = request.form.get('prompt')
+    aspect_ratio = request.form.get('aspect_ratio', '1:1')
+    try:
+        width = int(request.form.get('width', 512))
+        height = int(request.form.get('height', 512))
+        # Explicit seeds make variants reproducible, otherwise pick random ones
+        seeds = [int(seed) for seed in request.form.get('seeds', '').split(',') if seed.strip()]
+        if not seeds:
+            seeds = [random.randrange(2 ** 31) for _ in range(int(request.form.get('count', 4)))]
+    except ValueError:
+        return jsonify({"error": "Invalid width, height, count or seeds"}), 400
+    if not 1 <= len(seeds) <= app.config['GENERATION_USER_LIMIT']:
+        return jsonify({"error": f"A batch can have 1 to {app.config['GENERATION_USER_LIMIT']} variants"}), 400
+    
+    batch_id = uuid.uuid4().hex
+    try:
+        job_ids = submit_generation_jobs(current_user.id, [{
+            'prompt': prompt,
+            'aspect_ratio': aspect_ratio,
+            'width': width,
+            'height': height,
+            'seed': seed
+        } for seed in seeds], batch_id)
+        return jsonify({"batch_id": batch_id, "job_ids": job_ids}), 202
+    except GenerationQueueFull as e:
+        return jsonify({"error": str(e)}), 429
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    db = get_read_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT status, image_hash, error FROM jobs WHERE id = ? AND user_id = ?",
+                   (job_id, current_user.id))
+    job = cursor.fetchone()
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_payload(job_id, job[0], image_hash=job[1], error=job[2]))
+
+# Stored images and fingerprinted assets never change, so clients can cache
+# them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def _image_not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+@app.route('/image/<image_hash>')
+def image(image_hash):
+    if not IMAGE_HASH_RE.match(image_hash):
+        return "Image not found", 404
+    
+    # The hash is the strong ETag, so a matching If-None-Match needs no lookup
+    if image_hash in request.if_none_match:
+        return _image_not_modified(image_hash)
+    
+    db = get_read_db()
+    cursor = db.cursor()
+    cursor.execute("SELECT content_type FROM images WHERE hash = ?", (image_hash,))
+    row = cursor.fetchone()
+    if row is None:
+        return "Image not found", 404
+    
+    # conditional=True handles If-None-Match/If-Range and Range requests
+    response = send_file(os.path.abspath(image_path(image_hash)), mimetype=row[0],
+                         conditional=True, etag=image_hash)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+@app.route('/image/<image_hash>/<variant>')
+def image_variant(image_hash, variant):
+    if variant not in IMAGE_VARIANTS or not IMAGE_HASH_RE.match(image_hash):
+        return "Image not found", 404
+    
+    etag = f'{image_hash}-{variant}'
+    if etag in request.if_none_match:
+        return _image_not_modified(etag)
+    
+    db = get_read_db()
+    cursor = db.cursor()
+    if not image_exists(cursor, image_hash):
+        return "Image not found", 404
+    
+    try:
+        path = get_image_variant(image_hash, variant)
+    except FileNotFoundError:
+        return "Image not found", 404
+    except Exception as e:
+        print(f"Error generating image variant: {e}")
+        return 'Error', 500
+    response = send_file(os.path.abspath(path), mimetype='image/webp', conditional=True, etag=etag)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+# CSS and JS are linked with a content fingerprint in the URL, so browsers can
+# keep them until they change
+_asset_fingerprints = {}
+
+@app.template_global()
+def asset_url(filename):
+    path = os.path.join(app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _asset_fingerprints.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _asset_fingerprints[filename] = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+    return url_for('static', filename=filename, v=cached[1])
+
+@app.after_request
+def cache_fingerprinted_assets(response):
+    if request.endpoint == 'static' and 'v' in request.args and response.status_code == 200:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+# Text responses are compressed when the client accepts it; images are
+# already compressed and pass through untouched
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript', 'application/json'}
+
+@app.after_request
+def compress_response(response):
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or 'Content-Encoding' in response.headers
+            or (response.is_streamed and not response.direct_passthrough)):
+        return response
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding is None:
+        return response
+    
+    # Static files are sent as file wrappers; read them so they can be compressed
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < app.config['COMPRESSION_MIN_BYTES']:
+        return response
+    if encoding == 'br':
+        data = brotli.compress(data, quality=app.config['BROTLI_QUALITY'])
+    else:
+        data = gzip.compress(data, compresslevel=app.config['GZIP_LEVEL'], mtime=0)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ, so a strong validator can only stay as a weak one
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+@app.route('/stats')
+@login_required
+def stats():
+    return jsonify({"generation_cache": generation_cache.stats(),
+                    "broadcasts": broadcast_stats.snapshot(),
+                    "reaction_broadcasts": reaction_broadcaster.stats(),
+                    "render_cache": render_cache.stats(),
+                    "user_cache": user_cache.stats()})
+
+@app.route('/search')
+def search():
+    search_query = request.args.get('q', '').strip()
+    db = get_read_db()
+    cursor = db.cursor()
+    try:
+        messages, snippets, next_cursor = search_messages(cursor, search_query, request.args.get('cursor'))
+    except ValueError:
+        return "Invalid cursor", 400
+    
+    # Snippets differ per query, so search results are rendered uncached
+    fragments = [render_message(message, snippets.get(message.id)) for message in messages]
+    return render_template('base.html', fragments=fragments, next_cursor=next_cursor,
+                           search_query=search_query)
+
 @app.route('/tag/<tag_name>')
+@conditional_feed
 def view_tag(tag_name):
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
-    cursor.execute('''
-        SELECT messages.id, messages.content, messages.image_data, messages.timestamp, users.username, users.avatar
-        FROM messages
-        JOIN users ON messages.user_id = users.id
-        JOIN message_tags ON messages.id = message_tags.message_id
-        JOIN tags ON message_tags.tag_id = tags.id
-        WHERE tags.name = ?
-        ORDER BY messages.timestamp DESC
-    ''', (tag_name,))
-    messages = cursor.fetchall()
-    
-    for i, message in enumerate(messages):
-        cursor.execute('''
-            SELECT comments.content, comments.timestamp, users.username, users.avatar
-            FROM comments
-            JOIN users ON comments.user_id = users.id
-            WHERE comments.message_id = ?
-            ORDER BY comments.timestamp ASC
-        ''', (message[0],))
-        comments = cursor.fetchall()
-        
-        cursor.execute('''
-            SELECT tags.name
-            FROM tags
-            JOIN message_tags ON tags.id = message_tags.tag_id
-            WHERE message_tags.message_id = ?
-        ''', (message[0],))
-        tags = [tag[0] for tag in cursor.fetchall()]
-        
-        cursor.execute('''
-            SELECT reaction, COUNT(*) as count
-            FROM reactions
-            WHERE message_id = ?
-            GROUP BY reaction
-        ''', (message[0],))
-        reactions = dict(cursor.fetchall())
-        
-        messages[i] = message + (comments, tags, reactions)
+    try:
+        fragments, next_cursor = render_feed_page(cursor, f'tag:{tag_name}', request.args.get('cursor'),
+                                                  tag_name=tag_name)
+    except ValueError as e:
+        return str(e), 400
     
-    return render_template_string(BASE_HTML, messages=messages, current_tag=tag_name)
+    return render_template('base.html', fragments=fragments, next_cursor=next_cursor, current_tag=tag_name,
+                           feed=f'tag:{tag_name}')
 
 @app.route('/post_comment/<int:message_id>', methods=['POST'])
 @login_required
@@ -322,6 +2026,7 @@ def post_comment(message_id):
                        (current_user.id, message_id, content))
         comment_id = cursor.lastrowid
         db.commit()
+        render_cache.bump(f'message:{message_id}')
         
         cursor.execute('''
             SELECT comments.content, comments.timestamp, users.username, users.avatar
@@ -331,13 +2036,13 @@ def post_comment(message_id):
         ''', (comment_id,))
         new_comment = cursor.fetchone()
         
-        socketio.emit('new_comment', {
+        broadcast('new_comment', {
             'message_id': message_id,
             'content': new_comment[0],
             'timestamp': new_comment[1],
             'username': new_comment[2],
             'avatar': new_comment[3]
-        })
+        }, [message_room(message_id)])
     return redirect(url_for('index'))
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -345,16 +2050,24 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        if user and check_password_hash(user[2], password):
-            user_obj = User(user[0], user[1], user[3])
-            login_user(user_obj)
-            return redirect(url_for('index'))
-        return "Invalid username or password"
-    return render_template_string(LOGIN_HTML)
+        # Hashing can queue for a while, so no connection is held meanwhile
+        user = read_row("SELECT id, username, password, avatar FROM users WHERE username = ?", (username,))
+        try:
+            if not (user and verify_password(user[2], password)):
+                return "Invalid username or password"
+            if password_needs_rehash(user[2]):
+                new_hash = hash_password(password)
+                db = get_db()
+                db.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, user[0]))
+                db.commit()
+                invalidate_user(user[0])
+        except PasswordQueueFull as e:
+            return str(e), 503, {'Retry-After': '1'}
+        user_obj = User(user[0], user[1], user[3])
+        user_cache.put(user_obj)
+        login_user(user_obj)
+        return redirect(url_for('index'))
+    return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -362,16 +2075,22 @@ def register():
         username = request.form.get('username')
         password = request.form.get('password')
         avatar = request.form.get('avatar')
+        if read_row("SELECT 1 FROM users WHERE username = ?", (username,)):
+            return "Username already exists"
+        try:
+            password_hash = hash_password(password)
+        except PasswordQueueFull as e:
+            return str(e), 503, {'Retry-After': '1'}
         db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = ?", (username,))
-        if cursor.fetchone():
+        try:
+            db.execute("INSERT INTO users (username, password, avatar) VALUES (?, ?, ?)",
+                       (username, password_hash, avatar))
+        except sqlite3.IntegrityError:
+            # Taken by a concurrent registration while the password was hashed
             return "Username already exists"
-        cursor.execute("INSERT INTO users (username, password, avatar) VALUES (?, ?, ?)",
-                       (username, generate_password_hash(password), avatar))
         db.commit()
         return redirect(url_for('login'))
-    return render_template_string(REGISTER_HTML)
+    return render_template('register.html')
 
 @app.route('/logout')
 @login_required
@@ -380,542 +2099,192 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/profile/<username>')
+@conditional_feed
 def profile(username):
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
     cursor.execute("SELECT id, username, avatar FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
     if user is None:
         return "User not found", 404
     
-    cursor.execute('''
-        SELECT messages.id, messages.content, messages.image_data, messages.timestamp
-        FROM messages
-        WHERE messages.user_id = ?
-        ORDER BY messages.timestamp DESC
-    ''', (user[0],))
-    messages = cursor.fetchall()
+    try:
+        # The profile template shows no comments, tags or reactions
+        messages, next_cursor = fetch_feed_page(cursor, request.args.get('cursor'), user_id=user[0], include=())
+    except ValueError as e:
+        return str(e), 400
+    
+    return render_template('profile.html', user=user, messages=messages, next_cursor=next_cursor)
+
+def set_reaction(message_id, reaction, toggle=False):
+    """Add the current user's reaction, or with toggle remove it if already present.
+
+    Returns True when the stored reactions changed.
+    """
+    db = get_db()
+    cursor = db.cursor()
+    cursor.execute("INSERT OR IGNORE INTO reactions (message_id, user_id, reaction) VALUES (?, ?, ?)",
+                   (message_id, current_user.id, reaction))
+    changed = cursor.rowcount > 0
+    if not changed and toggle:
+        cursor.execute("DELETE FROM reactions WHERE message_id = ? AND user_id = ? AND reaction = ?",
+                       (message_id, current_user.id, reaction))
+        changed = cursor.rowcount > 0
+    db.commit()
     
-    return render_template_string(PROFILE_HTML, user=user, messages=messages)
+    if changed:
+        render_cache.bump(f'message:{message_id}')
+        reaction_broadcaster.mark(message_id)
+    return changed
 
 @app.route('/add_reaction/<int:message_id>/<reaction>')
 @login_required
 def add_reaction(message_id, reaction):
-    db = get_db()
-    cursor = db.cursor()
     try:
-        cursor.execute('''
-            INSERT INTO reactions (message_id, user_id, reaction)
-            VALUES (?, ?, ?)
-            ON CONFLICT(message_id, user_id, reaction) DO UPDATE SET reaction = excluded.reaction
-        ''', (message_id, current_user.id, reaction))
-        db.commit()
-        
-        cursor.execute('''
-            SELECT reaction, COUNT(*) as count
-            FROM reactions
-            WHERE message_id = ?
-            GROUP BY reaction
-        ''', (message_id,))
-        reactions = dict(cursor.fetchall())
-        
-        socketio.emit('reaction_update', {
-            'message_id': message_id,
-            'reactions': reactions
-        })
-        
+        set_reaction(message_id, reaction)
         return 'OK', 200
     except Exception as e:
         print(f"Error adding reaction: {e}")
         return 'Error', 500
 
+@app.route('/toggle_reaction/<int:message_id>/<reaction>', methods=['POST'])
+@login_required
+def toggle_reaction(message_id, reaction):
+    try:
+        set_reaction(message_id, reaction, toggle=True)
+        return 'OK', 200
+    except Exception as e:
+        print(f"Error toggling reaction: {e}")
+        return 'Error', 500
+
+# Versioned JSON API with the same data and cursors as the HTML pages, for
+# client-side rendering, mobile clients and scripts. ?fields=id,content,...
+# selects message fields; relations that are not selected are not queried.
+def api_response(data, status=200):
+    return app.response_class(json.dumps(data, separators=(',', ':'), ensure_ascii=False),
+                              status=status, mimetype='application/json')
+
+def api_error(message, status):
+    return api_response({'error': message}, status)
+
+def api_fields():
+    raw = request.args.get('fields')
+    if not raw:
+        return FeedMessage._fields
+    fields = tuple(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in FeedMessage._fields]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def serialize_message(message, fields):
+    data = {field: getattr(message, field) for field in fields}
+    if 'comments' in data:
+        data['comments'] = [comment._asdict() for comment in message.comments]
+    return data
+
+def api_feed_page(cursor, **filters):
+    fields = api_fields()
+    include = [relation for relation in FEED_RELATIONS if relation in fields]
+    messages, next_cursor = fetch_feed_page(cursor, request.args.get('cursor'), include=include, **filters)
+    return {'messages': [serialize_message(message, fields) for message in messages], 'next_cursor': next_cursor}
+
+@app.route('/api/v1/feed')
+@conditional_feed
+def api_feed():
+    cursor = get_read_db().cursor()
+    try:
+        return api_response(api_feed_page(cursor))
+    except ValueError as e:
+        return api_error(str(e), 400)
+
+@app.route('/api/v1/tags')
+def api_tags():
+    cursor = get_read_db().cursor()
+    return api_response({
+        'popular': [{'name': name, 'count': count} for name, count in popular_tags(cursor)],
+        'trending': [tag._asdict() for tag in trending_tags(cursor)]
+    })
+
+@app.route('/api/v1/tags/<tag_name>/messages')
+@conditional_feed
+def api_tag_messages(tag_name):
+    cursor = get_read_db().cursor()
+    try:
+        return api_response(api_feed_page(cursor, tag_name=tag_name))
+    except ValueError as e:
+        return api_error(str(e), 400)
+
+@app.route('/api/v1/users/<username>')
+@conditional_feed
+def api_profile(username):
+    cursor = get_read_db().cursor()
+    cursor.execute("SELECT id, username, avatar FROM users WHERE username = ?", (username,))
+    user = cursor.fetchone()
+    if user is None:
+        return api_error("User not found", 404)
+    try:
+        page = api_feed_page(cursor, user_id=user[0])
+    except ValueError as e:
+        return api_error(str(e), 400)
+    return api_response({'user': {'username': user[1], 'avatar': user[2]}, **page})
+
+@app.route('/api/v1/messages/<int:message_id>')
+@conditional_feed
+def api_message(message_id):
+    cursor = get_read_db().cursor()
+    try:
+        fields = api_fields()
+    except ValueError as e:
+        return api_error(str(e), 400)
+    cursor.execute(f'''
+        SELECT {FEED_COLUMNS}
+        FROM messages
+        JOIN users ON messages.user_id = users.id
+        WHERE messages.id = ?
+    ''', (message_id,))
+    rows = cursor.fetchall()
+    if not rows:
+        return api_error("Message not found", 404)
+    include = [relation for relation in FEED_RELATIONS if relation in fields]
+    return api_response(serialize_message(load_feed(cursor, rows, include)[0], fields))
+
+@app.route('/api/v1/messages/<int:message_id>/comments')
+@conditional_feed
+def api_comments(message_id):
+    cursor = get_read_db().cursor()
+    try:
+        rows, next_cursor = fetch_comment_page(cursor, message_id, request.args.get('cursor'))
+    except ValueError as e:
+        return api_error(str(e), 400)
+    return api_response({
+        'comments': [dict(zip(('id', 'content', 'timestamp', 'username', 'avatar'), row)) for row in rows],
+        'next_cursor': next_cursor
+    })
+
 @socketio.on('connect')
 def handle_connect():
     print('Client connected')
+    broadcast_stats.client_connected()
+    if current_user.is_authenticated:
+        join_room(user_room(current_user.id))
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    feed = (data or {}).get('feed')
+    if feed == 'home' or (isinstance(feed, str) and feed.startswith(('tag:', 'profile:'))):
+        join_room(feed_room(feed))
+
+@socketio.on('watch_messages')
+def handle_watch_messages(data):
+    for message_id in (data or {}).get('message_ids', [])[:MAX_WATCHED_MESSAGES]:
+        if isinstance(message_id, int):
+            join_room(message_room(message_id))
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Client disconnected')
-
-BASE_HTML = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Rad Message Board</title>
-    <style>
-        :root {
-            --bg-color: #000;
-            --text-color: #fff;
-            --border-color: #fff;
-            --input-bg-color: #000;
-            --input-text-color: #fff;
-            --button-bg-color: #fff;
-            --button-text-color: #000;
-            --tag-bg-color: #fff;
-            --tag-text-color: #000;
-        }
-        body {
-            font-family: 'Courier New', monospace;
-            background-color: var(--bg-color);
-            color: var(--text-color);
-            margin: 0;
-            padding: 20px;
-            transition: background-color 0.3s, color 0.3s;
-        }
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-        }
-        h1, h2 {
-            border-bottom: 4px solid var(--border-color);
-            padding-bottom: 10px;
-        }
-        .message, .comment {
-            border: 4px solid var(--border-color);
-            padding: 10px;
-            margin-bottom: 20px;
-        }
-        .message-content, .comment-content {
-            margin-bottom: 10px;
-            word-wrap: break-word;
-        }
-        .message-meta, .comment-meta {
-            font-size: 0.8em;
-            color: #ccc;
-            margin-bottom: 10px;
-        }
-        form {
-            margin-bottom: 20px;
-        }
-        input[type="text"], textarea {
-            width: calc(100% - 24px);
-            padding: 10px;
-            margin-bottom: 10px;
-            background-color: var(--input-bg-color);
-            color: var(--input-text-color);
-            border: 2px solid var(--border-color);
-        }
-        input[type="submit"], button {
-            background-color: var(--button-bg-color);
-            color: var(--button-text-color);
-            border: none;
-            padding: 10px 20px;
-            cursor: pointer;
-        }
-        .nav {
-            margin-bottom: 20px;
-        }
-        .nav a {
-            color: var(--text-color);
-            margin-right: 10px;
-        }
-        .comments-section {
-            margin-top: 10px;
-            padding-top: 10px;
-            border-top: 2px solid var(--border-color);
-        }
-        .avatar {
-            font-size: 1.5em;
-            margin-right: 5px;
-        }
-        .tag {
-            display: inline-block;
-            background-color: var(--tag-bg-color);
-            color: var(--tag-text-color);
-            padding: 2px 5px;
-            margin-right: 5px;
-            font-size: 0.8em;
-        }
-        .tag-cloud {
-            margin-bottom: 20px;
-        }
-        #generated-image {
-            max-width: 100%;
-            height: auto;
-            margin-top: 10px;
-        }
-    </style>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
-    <script>
-        var socket = io();
-        
-        function generateImage() {
-            var prompt = document.getElementById('image-prompt').value;
-            var aspectRatio = document.getElementById('aspect-ratio').value;
-            var width = document.getElementById('width').value;
-            var height = document.getElementById('height').value;
-            fetch('/generate_image', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                },
-                body: 'prompt=' + encodeURIComponent(prompt) + 
-                      '&aspect_ratio=' + encodeURIComponent(aspectRatio) +
-                      '&width=' + encodeURIComponent(width) +
-                      '&height=' + encodeURIComponent(height)
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.error) {
-                    alert('Error: ' + data.error);
-                } else {
-                    document.getElementById('generated-image').src = 'data:image/png;base64,' + data.image_data;
-                    document.getElementById('generated-image').style.display = 'block';
-                    document.getElementById('image-data').value = data.image_data;
-                }
-            });
-        }
-        
-        socket.on('new_message', function(message) {
-            var messagesContainer = document.querySelector('.container');
-            var newMessageElement = document.createElement('div');
-            newMessageElement.className = 'message';
-            newMessageElement.innerHTML = `
-                <div class="message-content">${message.content}</div>
-                ${message.image_data ? `<img src="data:image/png;base64,${message.image_data}" alt="Generated Image" style="max-width: 100%; height: auto;">` : ''}
-                <div class="message-meta">
-                    <span class="avatar">${message.avatar}</span>
-                    Posted by ${message.username} on ${message.timestamp}
-                </div>
-                <div class="message-tags">
-                    ${message.tags.map(tag => `<span class="tag">${tag}</span>`).join('')}
-                </div>
-                <div class="comments-section"></div>
-                <form action="/post_comment/${message.id}" method="post">
-                    <input type="text" name="content" placeholder="Add a comment" required>
-                    <input type="submit" value="Post Comment">
-                </form>
-            `;
-            messagesContainer.insertBefore(newMessageElement, messagesContainer.firstChild);
-        });
-        
-        socket.on('new_comment', function(comment) {
-            var messageElement = document.querySelector(`[data-message-id="${comment.message_id}"]`);
-            if (messageElement) {
-                var commentsSection = messageElement.querySelector('.comments-section');
-                var newCommentElement = document.createElement('div');
-                newCommentElement.className = 'comment';
-                newCommentElement.innerHTML = `
-                    <div class="comment-content">${comment.content}</div>
-                    <div class="comment-meta">
-                        <span class="avatar">${comment.avatar}</span>
-                        Posted by ${comment.username} on ${comment.timestamp}
-                    </div>
-                `;
-                commentsSection.appendChild(newCommentElement);
-            }
-        });
-
-        socket.on('reaction_update', function(data) {
-            var messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
-            if (messageElement) {
-                var reactionsElement = messageElement.querySelector('.reactions');
-                if (reactionsElement) {
-                    for (var reaction in data.reactions) {
-                        var button = reactionsElement.querySelector(`[data-reaction="${reaction}"]`);
-                        if (button) {
-                            button.textContent = `${reaction} ${data.reactions[reaction]}`;
-                        }
-                    }
-                }
-            }
-        });
-
-        function addReaction(messageId, reaction) {
-            fetch(`/add_reaction/${messageId}/${reaction}`, {method: 'GET'})
-                .then(response => {
-                    if (!response.ok) {
-                        throw new Error('Network response was not ok');
-                    }
-                })
-                .catch(error => console.error('Error:', error));
-        }
-    </script>
-</head>
-<body>
-    <div class="container">
-        <div class="nav">
-            <a href="{{ url_for('index') }}">Home</a>
-            {% if current_user.is_authenticated %}
-                <a href="{{ url_for('logout') }}">Logout</a>
-                <a href="{{ url_for('profile', username=current_user.username) }}">Profile</a>
-            {% else %}
-                <a href="{{ url_for('login') }}">Login</a>
-                <a href="{{ url_for('register') }}">Register</a>
-            {% endif %}
-        </div>
-        <h1>Rad Message Board</h1>
-        {% if popular_tags %}
-            <div class="tag-cloud">
-                <h2>Popular Tags</h2>
-                {% for tag, count in popular_tags %}
-                    <a href="{{ url_for('view_tag', tag_name=tag) }}" class="tag">{{ tag }} ({{ count }})</a>
-                {% endfor %}
-            </div>
-        {% endif %}
-        {% if current_user.is_authenticated %}
-            <form action="{{ url_for('post_message') }}" method="post">
-                <textarea name="content" placeholder="What's on your mind?" required></textarea>
-                <input type="text" name="tags" placeholder="Tags (comma-separated)">
-                <input type="text" id="image-prompt" placeholder="Image generation prompt">
-                <select id="aspect-ratio">
-                    <option value="1:1">1:1 (Square)</option>
-                    <option value="16:9">16:9 (Landscape)</option>
-                    <option value="9:16">9:16 (Portrait)</option>
-                </select>
-                <input type="number" id="width" placeholder="Width (default: 512)" value="512">
-                <input type="number" id="height" placeholder="Height (default: 512)" value="512">
-                <button type="button" onclick="generateImage()">Generate Image</button>
-                <img id="generated-image" src="" alt="Generated Image" style="display:none;">
-                <input type="hidden" id="image-data" name="image_data">
-                <input type="submit" value="Post Message">
-            </form>
-        {% endif %}
-        {% for message in messages %}
-            <div class="message" data-message-id="{{ message[0] }}">
-                <div class="message-content">{{ message[1] }}</div>
-                {% if message[2] %}
-                    <img src="data:image/png;base64,{{ message[2] }}" alt="Generated Image" style="max-width: 100%; height: auto;">
-                {% endif %}
-                <div class="message-meta">
-                    <span class="avatar">{{ message[5] }}</span>
-                    Posted by <a href="{{ url_for('profile', username=message[4]) }}">{{ message[4] }}</a> on {{ message[3] }}
-                </div>
-                {% if message[7] %}
-                    <div class="message-tags">
-                        {% for tag in message[7] %}
-                            <a href="{{ url_for('view_tag', tag_name=tag) }}" class="tag">{{ tag }}</a>
-                        {% endfor %}
-                    </div>
-                {% endif %}
-                <div class="reactions">
-                    <button onclick="addReaction({{ message[0] }}, '👍')" data-reaction="👍">👍 {{ message[8].get('👍', 0) }}</button>
-                    <button onclick="addReaction({{ message[0] }}, '❤️')" data-reaction="❤️">❤️ {{ message[8].get('❤️', 0) }}</button>
-                    <button onclick="addReaction({{ message[0] }}, '😂')" data-reaction="😂">😂 {{ message[8].get('😂', 0) }}</button>
-                    <button onclick="addReaction({{ message[0] }}, '😮')" data-reaction="😮">😮 {{ message[8].get('😮', 0) }}</button>
-                </div>
-                {% if message[6] %}
-                    <div class="comments-section">
-                        <h3>Comments:</h3>
-                        {% for comment in message[6] %}
-                            <div class="comment">
-                                <div class="comment-content">{{ comment[0] }}</div>
-                                <div class="comment-meta">
-                                    <span class="avatar">{{ comment[3] }}</span>
-                                    Posted by <a href="{{ url_for('profile', username=comment[2]) }}">{{ comment[2] }}</a> on {{ comment[1] }}
-                                </div>
-                            </div>
-                        {% endfor %}
-                    </div>
-                {% endif %}
-                {% if current_user.is_authenticated %}
-                    <form action="{{ url_for('post_comment', message_id=message[0]) }}" method="post">
-                        <input type="text" name="content" placeholder="Add a comment" required>
-                        <input type="submit" value="Post Comment">
-                    </form>
-                {% endif %}
-            </div>
-        {% endfor %}
-    </div>
-</body>
-</html>
-'''
-
-LOGIN_HTML = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Login - Rad Message Board</title>
-    <style>
-        body {
-            font-family: 'Courier New', monospace;
-            background-color: #000;
-            color: #fff;
-            margin: 0;
-            padding: 20px;
-        }
-        .container {
-            max-width: 400px;
-            margin: 0 auto;
-        }
-        h1 {
-            border-bottom: 4px solid #fff;
-            padding-bottom: 10px;
-        }
-        form {
-            border: 4px solid #fff;
-            padding: 20px;
-        }
-        input[type="text"], input[type="password"] {
-            width: 100%;
-            padding: 10px;
-            margin-bottom: 10px;
-            background-color: #000;
-            color: #fff;
-            border: 2px solid #fff;
-        }
-        input[type="submit"] {
-            background-color: #fff;
-            color: #000;
-            border: none;
-            padding: 10px 20px;
-            cursor: pointer;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Login</h1>
-        <form action="{{ url_for('login') }}" method="post">
-            <input type="text" name="username" placeholder="Username" required>
-            <input type="password" name="password" placeholder="Password" required>
-            <input type="submit" value="Login">
-        </form>
-    </div>
-</body>
-</html>
-'''
-
-REGISTER_HTML = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Register - Rad Message Board</title>
-    <style>
-        body {
-            font-family: 'Courier New', monospace;
-            background-color: #000;
-            color: #fff;
-            margin: 0;
-            padding: 20px;
-        }
-        .container {
-            max-width: 400px;
-            margin: 0 auto;
-        }
-        h1 {
-            border-bottom: 4px solid #fff;
-            padding-bottom: 10px;
-        }
-        form {
-            border: 4px solid #fff;
-            padding: 20px;
-        }
-        input[type="text"], input[type="password"], select {
-            width: 100%;
-            padding: 10px;
-            margin-bottom: 10px;
-            background-color: #000;
-            color: #fff;
-            border: 2px solid #fff;
-        }
-        input[type="submit"] {
-            background-color: #fff;
-            color: #000;
-            border: none;
-            padding: 10px 20px;
-            cursor: pointer;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>Register</h1>
-        <form action="{{ url_for('register') }}" method="post">
-            <input type="text" name="username" placeholder="Username" required>
-            <input type="password" name="password" placeholder="Password" required>
-            <select name="avatar" required>
-                <option value="">Select Avatar</option>
-                <option value="😊">😊</option>
-                <option value="🤠">🤠</option>
-                <option value="🤖">🤖</option>
-                <option value="👽">👽</option>
-                <option value="🦄">🦄</option>
-            </select>
-            <input type="submit" value="Register">
-        </form>
-    </div>
-</body>
-</html>
-'''
-
-PROFILE_HTML = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{{ user[1] }}'s Profile - Rad Message Board</title>
-    <style>
-        body {
-            font-family: 'Courier New', monospace;
-            background-color: #000;
-            color: #fff;
-            margin: 0;
-            padding: 20px;
-        }
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-        }
-        h1, h2 {
-            border-bottom: 4px solid #fff;
-            padding-bottom: 10px;
-        }
-        .message {
-            border: 4px solid #fff;
-            padding: 10px;
-            margin-bottom: 20px;
-        }
-        .message-content {
-            margin-bottom: 10px;
-            word-wrap: break-word;
-        }
-        .message-meta {
-            font-size: 0.8em;
-            color: #ccc;
-        }
-        .avatar {
-            font-size: 2em;
-            margin-right: 10px;
-        }
-        .nav {
-            margin-bottom: 20px;
-        }
-        .nav a {
-            color: #fff;
-            margin-right: 10px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="nav">
-            <a href="{{ url_for('index') }}">Home</a>
-            <a href="{{ url_for('logout') }}">Logout</a>
-        </div>
-        <h1>{{ user[1] }}'s Profile</h1>
-        <p><span class="avatar">{{ user[2] }}</span> {{ user[1] }}</p>
-        <h2>Messages</h2>
-        {% for message in messages %}
-            <div class="message">
-                <div class="message-content">{{ message[1] }}</div>
-                {% if message[2] %}
-                    <img src="data:image/png;base64,{{ message[2] }}" alt="Generated Image" style="max-width: 100%; height: auto;">
-                {% endif %}
-                <div class="message-meta">Posted on {{ message[3] }}</div>
-            </div>
-        {% endfor %}
-    </div>
-</body>
-</html>
-'''
+    broadcast_stats.client_disconnected()
 
 if __name__ == '__main__':
     socketio.run(app, debug=True)
\ No newline at end of file
@@ -0,0 +1,100 @@
+"""Cost of broadcasting a new post: the old base64 payload vs the slim one.
+
+"before" emits new_message the way the app used to: to every connected client,
+with the generated PNG inlined as base64. "after" emits the current payload,
+which carries only the image hash, through broadcast() to the rooms of the
+feeds showing the post. CLIENTS Socket.IO test clients are connected and spread
+over the home feed, two tag feeds and the author's profile; the post is tagged
+with one of the tags, so three of every four clients should receive it.
+
+    python benchmarks/broadcast_cost.py --clients 200 --posts 20
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEEDS = ('home', 'tag:cats', 'tag:dogs', 'profile:bench')
+
+def setup_app(workdir):
+    os.chdir(workdir)
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'board.db')
+    os.environ.setdefault('REPLICATE_API_TOKEN', 'benchmark')
+    sys.path.insert(0, ROOT)
+    import app as board
+    return board
+
+def generated_png(size):
+    # Noise compresses about as badly as a generated picture does
+    buffered = io.BytesIO()
+    Image.frombytes('RGB', (size, size), os.urandom(size * size * 3)).save(buffered, format='PNG')
+    return buffered.getvalue()
+
+def connect_clients(board, count):
+    clients = []
+    # The connect handler prints a line per client
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(count):
+            client = board.socketio.test_client(board.app)
+            client.emit('subscribe', {'feed': FEEDS[index % len(FEEDS)]})
+            clients.append(client)
+    return clients
+
+def payload_bytes(payload):
+    return len(json.dumps(payload, separators=(',', ':')).encode())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=20)
+    parser.add_argument('--image-size', type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        board = setup_app(workdir)
+        image = generated_png(args.image_size)
+        message = {'id': 1, 'content': 'A new post', 'timestamp': '2021-11-01 12:00:00',
+                   'username': 'bench', 'avatar': '🙂', 'tags': ['cats']}
+        old_payload = dict(message, image_data=base64.b64encode(image).decode(), reactions={})
+        new_payload = dict(message, image_hash=hashlib.sha256(image).hexdigest())
+        rooms = [board.feed_room('home'), board.feed_room('profile:bench'), board.feed_room('tag:cats')]
+
+        def before():
+            board.socketio.emit('new_message', old_payload)
+
+        def after():
+            board.broadcast('new_message', new_payload, rooms)
+
+        clients = connect_clients(board, args.clients)
+        # Recipients as the server sees them: everyone for a global emit, the
+        # members of each room for broadcast()
+        recipients = {'before': len(clients), 'after': sum(board.room_size(room) for room in rooms)}
+        print(f"{args.clients} clients, {args.posts} posts, {len(image) // 1024} KiB image")
+        for name, emit, payload in (('before', before, old_payload), ('after', after, new_payload)):
+            started = time.perf_counter()
+            for _ in range(args.posts):
+                emit()
+            per_post = (time.perf_counter() - started) / args.posts
+            for client in clients:
+                client.get_received()
+            print(f"{name:>6}: {per_post * 1000:.2f} ms per post, {payload_bytes(payload)} byte payload, "
+                  f"{recipients[name]} recipients, "
+                  f"{payload_bytes(payload) * recipients[name] / 1024:.1f} KiB sent per post")
+        stats = board.broadcast_stats.snapshot()['events']['new_message']
+        print(f"broadcast stats for 'after': {stats['count']} broadcasts, "
+              f"{stats['fanout_bytes'] // stats['count']} fan-out bytes each")
+        with contextlib.redirect_stdout(io.StringIO()):
+            for client in clients:
+                client.disconnect()
+
+if __name__ == '__main__':
+    main()
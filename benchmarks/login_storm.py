@@ -0,0 +1,115 @@
+"""Socket latency during a login storm, with password hashing inline vs on the pool.
+
+A background task emits a tick to a connected Socket.IO test client every
+10 ms. How late each tick goes out is the extra latency every other socket
+user sees while logins are being processed. Meanwhile CONCURRENCY clients log
+in LOGINS times in total, first with hashing done inline on the request, as
+before, then with the bounded password pool.
+
+    python benchmarks/login_storm.py --logins 64 --concurrency 8
+
+With eventlet installed the app runs on green threads, which is where inline
+hashing stalls every other greenlet; otherwise real threads are used.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+    import eventlet
+    eventlet.monkey_patch()
+except ImportError:
+    eventlet = None
+
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TICK = 0.01
+
+def setup_app(workdir):
+    os.chdir(workdir)
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'board.db')
+    os.environ.setdefault('REPLICATE_API_TOKEN', 'benchmark')
+    sys.path.insert(0, ROOT)
+    import app as board
+    return board
+
+def add_users(board, count, password):
+    password_hash = board.generate_password_hash(password, board.app.config['PASSWORD_HASH_METHOD'])
+    db = board.write_pool.acquire()
+    try:
+        db.executemany("INSERT INTO users (username, password, avatar) VALUES (?, ?, ?)",
+                       [(f'bench{i}', password_hash, '🙂') for i in range(count)])
+        db.commit()
+    finally:
+        board.write_pool.release(db)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def run(board, logins, concurrency, password):
+    socket_client = board.socketio.test_client(board.app)
+    lags = []
+    stop = threading.Event()
+
+    def ticker():
+        while not stop.is_set():
+            due = time.perf_counter() + TICK
+            board.socketio.sleep(TICK)
+            board.socketio.emit('bench_tick', {})
+            lags.append(time.perf_counter() - due)
+            socket_client.get_received()
+
+    statuses = []
+
+    def login_worker(index):
+        client = board.app.test_client()
+        for n in range(index, logins, concurrency):
+            response = client.post('/login', data={'username': f'bench{n}', 'password': password})
+            statuses.append(response.status_code)
+
+    tick_thread = threading.Thread(target=ticker)
+    tick_thread.start()
+    time.sleep(0.2)
+    lags.clear()
+    started = time.perf_counter()
+    workers = [threading.Thread(target=login_worker, args=(index,)) for index in range(concurrency)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    tick_thread.join()
+    socket_client.disconnect()
+    return elapsed, lags, statuses
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    password = 'benchmark-password'
+    with tempfile.TemporaryDirectory() as workdir:
+        board = setup_app(workdir)
+        add_users(board, args.logins, password)
+        pooled = board._run_password_task
+        print(f"async mode: {board.socketio.async_mode}, {args.logins} logins, concurrency {args.concurrency}, "
+              f"hash method {board.app.config['PASSWORD_HASH_METHOD']}")
+        for mode in ('inline', 'pool'):
+            board._run_password_task = pooled if mode == 'pool' else lambda function, *a: function(*a)
+            elapsed, lags, statuses = run(board, args.logins, args.concurrency, password)
+            lags_ms = [lag * 1000 for lag in lags] or [0.0]
+            print(f"{mode:>6}: {len(statuses) / elapsed:6.1f} logins/s, "
+                  f"{sum(status == 503 for status in statuses)} rejected, socket tick lag "
+                  f"p50 {statistics.median(lags_ms):.1f} ms, p99 {percentile(lags_ms, 0.99):.1f} ms, "
+                  f"max {max(lags_ms):.1f} ms over {len(lags)} ticks")
+        board._run_password_task = pooled
+
+if __name__ == '__main__':
+    main()
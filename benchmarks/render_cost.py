@@ -0,0 +1,90 @@
+"""Render cost of a feed page: per-request template compilation vs loaded templates.
+
+"before" renders the page the way the app did with render_template_string:
+one template source, with the message markup inlined in the feed loop, is
+compiled on every request. "after" uses render_template, which compiles each
+template once per process (or loads it from the bytecode cache), and renders
+every message as a fragment. Both render the same page of messages with their
+comments, tags and reactions; no render cache is involved.
+
+    python benchmarks/render_cost.py --messages 20 --requests 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from flask import render_template_string
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup_app(workdir):
+    os.chdir(workdir)
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'board.db')
+    os.environ['JINJA_CACHE_DIR'] = os.path.join(workdir, 'jinja_cache')
+    os.environ.setdefault('REPLICATE_API_TOKEN', 'benchmark')
+    sys.path.insert(0, ROOT)
+    import app as board
+    return board
+
+def add_messages(board, count):
+    db = board.write_pool.acquire()
+    try:
+        cursor = db.cursor()
+        cursor.execute("INSERT INTO users (username, password, avatar) VALUES ('bench', 'x', '🙂')")
+        user_id = cursor.lastrowid
+        for n in range(count):
+            cursor.execute("INSERT INTO messages (user_id, content) VALUES (?, ?)", (user_id, f'Message number {n}'))
+            message_id = cursor.lastrowid
+            board.attach_tags(cursor, [(message_id, ['benchmark', f'tag{n % 5}'])])
+            cursor.executemany("INSERT INTO comments (user_id, message_id, content) VALUES (?, ?, ?)",
+                               [(user_id, message_id, f'Comment {c}') for c in range(3)])
+            cursor.execute("INSERT INTO reactions (message_id, user_id, reaction) VALUES (?, ?, '👍')",
+                           (message_id, user_id))
+        db.commit()
+    finally:
+        board.write_pool.release(db)
+
+def template_source(board, name):
+    with open(os.path.join(board.app.root_path, board.app.template_folder, name), encoding='utf-8') as f:
+        return f.read()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        board = setup_app(workdir)
+        board.app.config['FEED_PAGE_SIZE'] = args.messages
+        add_messages(board, args.messages)
+        fragment_loop = '{% for fragment in fragments %}\n            {{ fragment }}\n'
+        page_source = template_source(board, 'base.html')
+        assert fragment_loop in page_source
+        inline_source = page_source.replace(
+            fragment_loop, '{% for message in messages %}\n' + template_source(board, '_message.html'))
+
+        def before(messages, next_cursor):
+            return render_template_string(inline_source, messages=messages, snippet=None, next_cursor=next_cursor,
+                                          feed='home')
+
+        def after(messages, next_cursor):
+            fragments = [board.render_message(message) for message in messages]
+            return board.render_template('base.html', fragments=fragments, next_cursor=next_cursor, feed='home')
+
+        with board.app.test_request_context('/'):
+            messages, next_cursor = board.fetch_feed_page(board.get_read_db().cursor())
+            before(messages, next_cursor)
+            after(messages, next_cursor)
+            print(f"{args.messages} messages per page, {args.requests} renders")
+            for name, render in (('before', before), ('after', after)):
+                started = time.perf_counter()
+                for _ in range(args.requests):
+                    render(messages, next_cursor)
+                per_request = (time.perf_counter() - started) / args.requests
+                print(f"{name:>6}: {per_request * 1000:.2f} ms per page")
+
+if __name__ == '__main__':
+    main()
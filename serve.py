@@ -0,0 +1,64 @@
+"""Production entry point: run the board as several worker processes.
+
+Each worker listens on its own port (PORT, PORT+1, ...) and all of them share
+a Socket.IO message queue, so an emit from any worker reaches every client.
+Put a load balancer with sticky sessions (e.g. nginx ip_hash) in front of the
+worker ports; Socket.IO long-polling requires it.
+
+    python serve.py --workers 4 --port 8000
+
+Without SOCKETIO_MESSAGE_QUEUE set, a local SQLite queue file is used, which
+is enough when all workers run on one machine. Use redis://... or amqp://...
+to spread workers over several machines.
+
+The rendered feed cache defaults to the file backend here, because its
+version tokens must be shared for a write on one worker to invalidate the
+pages cached by the others.
+"""
+import argparse
+import multiprocessing
+import os
+
+DEFAULT_QUEUE = 'sqlite:///socketio_queue.db'
+
+def run_worker(index, host, port):
+    os.environ['SERVE_WORKER'] = str(index)
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+    except ImportError:
+        pass
+    from app import app, socketio
+    socketio.run(app, host=host, port=port + index, debug=False, use_reloader=False)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WORKERS', multiprocessing.cpu_count())))
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    args = parser.parse_args()
+
+    os.environ.setdefault('SOCKETIO_MESSAGE_QUEUE', DEFAULT_QUEUE)
+    os.environ.setdefault('RENDER_CACHE_BACKEND', 'file')
+
+    # Importing the app here migrates the database and fails interrupted jobs
+    # once, before any worker starts; workers skip that step
+    import app  # noqa: F401
+
+    # Spawn rather than fork so no worker inherits the parent's connections
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_worker, args=(index, args.host, args.port), daemon=True)
+               for index in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    print(f"Started {args.workers} workers on {args.host}:{args.port}-{args.port + args.workers - 1} "
+          f"using message queue {os.environ['SOCKETIO_MESSAGE_QUEUE']}")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+if __name__ == '__main__':
+    main()
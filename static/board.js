@@ -0,0 +1,223 @@
+var socket = io();
+
+// Join the rooms for this page's feed and the messages on screen.
+// Rooms belong to the connection, so this runs again after a reconnect.
+// Profile pages show no comments or reactions, so they only need their feed.
+function watchMessages(elements) {
+    if ((document.body.dataset.feed || '').startsWith('profile:')) {
+        return;
+    }
+    var ids = Array.from(elements).map(element => Number(element.dataset.messageId)).filter(id => id);
+    if (ids.length) {
+        socket.emit('watch_messages', {message_ids: ids});
+    }
+}
+
+socket.on('connect', function() {
+    function subscribe() {
+        socket.emit('subscribe', {feed: document.body.dataset.feed || null});
+        watchMessages(document.querySelectorAll('#messages > .message'));
+    }
+    if (document.readyState === 'loading') {
+        document.addEventListener('DOMContentLoaded', subscribe);
+    } else {
+        subscribe();
+    }
+});
+
+var pendingJobs = {};
+
+function generateImage() {
+    var prompt = document.getElementById('image-prompt').value;
+    var aspectRatio = document.getElementById('aspect-ratio').value;
+    var width = document.getElementById('width').value;
+    var height = document.getElementById('height').value;
+    var count = document.getElementById('variant-count').value;
+    fetch('/generate_batch', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+        },
+        body: 'prompt=' + encodeURIComponent(prompt) + 
+              '&aspect_ratio=' + encodeURIComponent(aspectRatio) +
+              '&width=' + encodeURIComponent(width) +
+              '&height=' + encodeURIComponent(height) +
+              '&count=' + encodeURIComponent(count)
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            alert('Error: ' + data.error);
+        } else {
+            pendingJobs = {};
+            data.job_ids.forEach(jobId => pendingJobs[jobId] = true);
+            document.getElementById('candidates').innerHTML = '';
+            document.getElementById('generated-image').style.display = 'none';
+            document.getElementById('image-hash').value = '';
+            updateGenerationStatus('Queued...');
+        }
+    });
+}
+
+function updateGenerationStatus(text) {
+    var remaining = Object.keys(pendingJobs).length;
+    document.getElementById('generation-status').textContent = remaining ? text + ' (' + remaining + ' left)' : '';
+}
+
+function selectCandidate(imageHash, candidate) {
+    document.querySelectorAll('.candidate').forEach(element => element.classList.remove('selected'));
+    candidate.classList.add('selected');
+    document.getElementById('generated-image').src = '/image/' + imageHash + '/feed';
+    document.getElementById('generated-image').style.display = 'block';
+    document.getElementById('image-hash').value = imageHash;
+}
+
+function addCandidate(imageHash) {
+    var candidate = document.createElement('img');
+    candidate.className = 'candidate';
+    candidate.src = '/image/' + imageHash + '/thumb';
+    candidate.alt = 'Generated Image';
+    candidate.onclick = () => selectCandidate(imageHash, candidate);
+    document.getElementById('candidates').appendChild(candidate);
+    if (!document.getElementById('image-hash').value) {
+        selectCandidate(imageHash, candidate);
+    }
+}
+
+socket.on('job_update', function(job) {
+    if (!pendingJobs[job.job_id]) {
+        return;
+    }
+    if (job.status === 'succeeded') {
+        delete pendingJobs[job.job_id];
+        addCandidate(job.image_hash);
+        updateGenerationStatus('Generating...');
+    } else if (job.status === 'failed') {
+        delete pendingJobs[job.job_id];
+        updateGenerationStatus('Generating...');
+        alert('Error: ' + job.error);
+    } else {
+        updateGenerationStatus(job.stage ? job.stage.charAt(0).toUpperCase() + job.stage.slice(1) + '...' : 'Running...');
+    }
+});
+
+socket.on('new_message', function(message) {
+    var messagesContainer = document.getElementById('messages');
+    var newMessageElement = document.createElement('div');
+    newMessageElement.className = 'message';
+    newMessageElement.dataset.messageId = message.id;
+    // Only the image hash is broadcast; the browser fetches the variant it needs
+    var imageUrl = message.image_hash ? `/image/${message.image_hash}` : null;
+    newMessageElement.innerHTML = `
+        <div class="message-content">${message.content}</div>
+        ${imageUrl ? `<img src="${imageUrl}/feed" srcset="${imageUrl}/thumb 256w, ${imageUrl}/feed 800w" sizes="(max-width: 800px) 100vw, 800px" alt="Generated Image" loading="lazy" style="max-width: 100%; height: auto;">` : ''}
+        <div class="message-meta">
+            <span class="avatar">${message.avatar}</span>
+            Posted by ${message.username} on ${message.timestamp}
+        </div>
+        <div class="message-tags">
+            ${message.tags.map(tag => `<span class="tag">${tag}</span>`).join('')}
+        </div>
+        <div class="comments-section"></div>
+        <form action="/post_comment/${message.id}" method="post">
+            <input type="text" name="content" placeholder="Add a comment" required>
+            <input type="submit" value="Post Comment">
+        </form>
+    `;
+    messagesContainer.insertBefore(newMessageElement, messagesContainer.firstChild);
+    watchMessages([newMessageElement]);
+});
+
+socket.on('new_comment', function(comment) {
+    var messageElement = document.querySelector(`[data-message-id="${comment.message_id}"]`);
+    if (messageElement) {
+        var commentsSection = messageElement.querySelector('.comments-section');
+        if (!commentsSection) {
+            // Messages without comments are rendered without a comments section
+            commentsSection = document.createElement('div');
+            commentsSection.className = 'comments-section';
+            commentsSection.innerHTML = '<h3>Comments:</h3>';
+            var form = messageElement.querySelector('form');
+            messageElement.insertBefore(commentsSection, form);
+        }
+        var newCommentElement = document.createElement('div');
+        newCommentElement.className = 'comment';
+        newCommentElement.innerHTML = `
+            <div class="comment-content">${comment.content}</div>
+            <div class="comment-meta">
+                <span class="avatar">${comment.avatar}</span>
+                Posted by ${comment.username} on ${comment.timestamp}
+            </div>
+        `;
+        commentsSection.appendChild(newCommentElement);
+    }
+});
+
+socket.on('reaction_update', function(data) {
+    var messageElement = document.querySelector(`[data-message-id="${data.message_id}"]`);
+    if (messageElement) {
+        var reactionsElement = messageElement.querySelector('.reactions');
+        if (reactionsElement) {
+            // Reactions missing from the update have dropped to zero
+            reactionsElement.querySelectorAll('[data-reaction]').forEach(button => {
+                var reaction = button.dataset.reaction;
+                button.textContent = `${reaction} ${data.reactions[reaction] || 0}`;
+            });
+        }
+    }
+});
+
+// Infinite scroll: fetch the next page and append its messages
+function loadMore(link) {
+    link.dataset.loading = 'true';
+    link.textContent = 'Loading...';
+    fetch(link.href)
+        .then(response => response.text())
+        .then(html => {
+            var page = new DOMParser().parseFromString(html, 'text/html');
+            var messagesContainer = document.getElementById('messages');
+            var added = [];
+            page.querySelectorAll('#messages > .message').forEach(element => {
+                added.push(messagesContainer.appendChild(document.importNode(element, true)));
+            });
+            watchMessages(added);
+            var next = page.getElementById('load-more');
+            if (next) {
+                link.href = next.href;
+                link.textContent = 'Load more';
+                delete link.dataset.loading;
+            } else {
+                link.remove();
+            }
+        });
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    var link = document.getElementById('load-more');
+    if (!link) {
+        return;
+    }
+    link.addEventListener('click', function(event) {
+        event.preventDefault();
+        if (!link.dataset.loading) {
+            loadMore(link);
+        }
+    });
+    if ('IntersectionObserver' in window) {
+        new IntersectionObserver(function(entries) {
+            if (entries[0].isIntersecting && link.isConnected && !link.dataset.loading) {
+                loadMore(link);
+            }
+        }).observe(link);
+    }
+});
+
+function toggleReaction(messageId, reaction) {
+    fetch(`/toggle_reaction/${messageId}/${reaction}`, {method: 'POST'})
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok');
+            }
+        })
+        .catch(error => console.error('Error:', error));
+}
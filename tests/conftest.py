@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# app.py configures itself from the environment and migrates its database at
+# import time, so point everything at a scratch directory first
+_workdir = tempfile.mkdtemp(prefix='board-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_workdir, 'board.db')
+os.environ['IMAGE_DIR'] = os.path.join(_workdir, 'images')
+os.environ['IMAGE_VARIANT_DIR'] = os.path.join(_workdir, 'image_variants')
+os.environ['RENDER_CACHE_DIR'] = os.path.join(_workdir, 'render_cache')
+os.environ['JINJA_CACHE_DIR'] = os.path.join(_workdir, 'jinja_cache')
+os.environ.setdefault('REPLICATE_API_TOKEN', 'test-token')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as board  # noqa: E402
+
+@pytest.fixture
+def db(tmp_path):
+    """A freshly migrated board database."""
+    db = sqlite3.connect(tmp_path / 'board.db')
+    board.migrate_db(db)
+    yield db
+    db.close()
+
+def seed(db, messages, comments_per_message=2, tags=('cats', 'dogs')):
+    """Add a user with ``messages`` tagged messages, each with comments and a reaction."""
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO users (username, password, avatar) VALUES ('alice', 'x', '🐱')")
+    user_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO tags (name) VALUES (?)", [(tag,) for tag in tags])
+    tag_ids = [row[0] for row in cursor.execute("SELECT id FROM tags ORDER BY id")]
+    for n in range(messages):
+        cursor.execute("INSERT INTO messages (user_id, content, timestamp) VALUES (?, ?, datetime('now', ?))",
+                       (user_id, f'message {n}', f'-{messages - n} minutes'))
+        message_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO message_tags (message_id, tag_id) VALUES (?, ?)",
+                           [(message_id, tag_id) for tag_id in tag_ids])
+        board.record_tag_usage(cursor, tag_ids)
+        cursor.executemany("INSERT INTO comments (user_id, message_id, content) VALUES (?, ?, ?)",
+                           [(user_id, message_id, f'comment {c}') for c in range(comments_per_message)])
+        cursor.execute("INSERT INTO reactions (message_id, user_id, reaction) VALUES (?, ?, '👍')",
+                       (message_id, user_id))
+    db.commit()
+    return user_id
+
+class StatementLog:
+    """Records every SQL statement a connection runs, with parameters bound."""
+
+    def __init__(self, db):
+        self.statements = []
+        self._db = db
+
+    def __enter__(self):
+        self._db.set_trace_callback(self.statements.append)
+        return self
+
+    def __exit__(self, *exc):
+        self._db.set_trace_callback(None)
+
+    @property
+    def selects(self):
+        return [sql for sql in self.statements if sql.lstrip().upper().startswith('SELECT')]
@@ -0,0 +1,36 @@
+"""load_feed must cost a fixed number of statements, however large the page."""
+import pytest
+
+from conftest import StatementLog, board, seed
+
+def feed_rows(db):
+    return db.execute(f'''
+        SELECT {board.FEED_COLUMNS}
+        FROM messages
+        JOIN users ON messages.user_id = users.id
+        ORDER BY messages.timestamp DESC, messages.id DESC
+    ''').fetchall()
+
+def count_statements(db, rows):
+    with StatementLog(db) as log:
+        messages = board.load_feed(db.cursor(), rows)
+    return len(log.statements), messages
+
+@pytest.mark.parametrize('page_size', [5, 500])
+def test_statement_count_is_independent_of_page_size(db, page_size):
+    seed(db, page_size)
+    statements, messages = count_statements(db, feed_rows(db))
+    # One query each for comments, tags and reactions
+    assert statements == 3
+    assert len(messages) == page_size
+    assert all(len(message.comments) == 2 for message in messages)
+    assert all(message.tags == ['cats', 'dogs'] for message in messages)
+    assert all(message.reactions == {'👍': 1} for message in messages)
+
+def test_relations_left_out_are_not_queried(db):
+    seed(db, 5)
+    rows = feed_rows(db)
+    with StatementLog(db) as log:
+        messages = board.load_feed(db.cursor(), rows, include=('tags',))
+    assert len(log.statements) == 1
+    assert all(message.comments == [] and message.tags for message in messages)
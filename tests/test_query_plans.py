@@ -0,0 +1,59 @@
+"""The hot read queries must be served by indexes, never by full table scans."""
+import re
+
+import pytest
+
+from conftest import StatementLog, board, seed
+
+# "SCAN t" without an index is a full table scan; "SCAN t USING INDEX" walks an
+# index in order and stops at the LIMIT
+FULL_SCAN = re.compile(r'^SCAN \w+$')
+
+def full_scans(db, sql):
+    plan = db.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()
+    return [detail for *_, detail in plan if FULL_SCAN.match(detail)]
+
+def assert_indexed(db, statements):
+    assert statements
+    for sql in statements:
+        assert full_scans(db, sql) == [], sql
+
+@pytest.fixture
+def seeded(db):
+    user_id = seed(db, 30)
+    board.tag_rankings.invalidate()
+    return db, user_id
+
+# Profile pages load no comments, tags or reactions
+@pytest.mark.parametrize('filters, selects', [({}, 8), ({'tag_name': 'cats'}, 8), ('profile', 2)],
+                         ids=['home', 'tag', 'profile'])
+def test_feed_pages_use_indexes(seeded, filters, selects):
+    db, user_id = seeded
+    if filters == 'profile':
+        filters = {'user_id': user_id, 'include': ()}
+    cursor = db.cursor()
+    _, next_cursor = board.fetch_feed_page(cursor, **filters)
+    assert next_cursor
+    # Check both the first page and a deeper one, which adds the keyset condition
+    with StatementLog(db) as log:
+        board.fetch_feed_page(cursor, **filters)
+        board.fetch_feed_page(cursor, next_cursor, **filters)
+    # The page queries plus load_feed's comment, tag and reaction IN queries
+    assert len(log.selects) == selects
+    assert_indexed(db, log.selects)
+
+def test_comment_pages_use_indexes(seeded):
+    db, _ = seeded
+    cursor = db.cursor()
+    with StatementLog(db) as log:
+        _, next_cursor = board.fetch_comment_page(cursor, 1)
+        board.fetch_comment_page(cursor, 1, board.encode_cursor('2000-01-01 00:00:00', 0))
+    assert_indexed(db, log.selects)
+
+def test_tag_rankings_use_indexes(seeded):
+    db, _ = seeded
+    cursor = db.cursor()
+    with StatementLog(db) as log:
+        assert board.popular_tags(cursor)
+        assert board.trending_tags(cursor)
+    assert_indexed(db, log.selects)